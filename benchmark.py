@@ -0,0 +1,484 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+# Benchmarks for the Mini-LISP interpreter.
+# Usage: python benchmark.py [startup|lexer|tokens|streaming|ast|eval|calls|deep|expressions|logic|fold|inline|types|memo ...] [--runs N]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(HERE, "main.py")
+TABLE_CACHES = [os.path.join(HERE, "parsetab.pickle"), os.path.join(HERE, "lextab.pickle")]
+
+
+def clear_table_caches():
+    for path in TABLE_CACHES:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def time_main(source, runs, before_each=None, args=()):
+    # 在暫存目錄中以 input.txt 執行 main.py（附加命令列參數 args），回傳每次的牆鐘時間
+    times = []
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "input.txt"), "w") as f:
+            f.write(source)
+        for _ in range(runs):
+            if before_each:
+                before_each()
+            start = time.perf_counter()
+            subprocess.run([sys.executable, MAIN, *args], cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_startup(runs):
+    # 預設的 Scanner 只用到 parsetab 快取，--lexer=ply 另外用到 lextab 快取
+    source = "(print-num 1)\n"
+    for lexer in ("scanner", "ply"):
+        args = ("--lexer=" + lexer,)
+        cold = time_main(source, runs, before_each=clear_table_caches, args=args)
+        # 先跑一次以建立快取
+        time_main(source, 1, args=args)
+        warm = time_main(source, runs, args=args)
+        print(f"startup {lexer:7s} cold (no table caches): median {median(cold) * 1000:.1f} ms over {runs} runs")
+        print(f"startup {lexer:7s} warm (table caches):    median {median(warm) * 1000:.1f} ms over {runs} runs")
+
+
+def load_programs(directories=("test_data", "hidden_data")):
+    programs = []
+    for directory in directories:
+        directory = os.path.join(HERE, directory)
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), "r") as f:
+                programs.append(f.read())
+    return programs
+
+
+def count_tokens(lexer, source):
+    lexer.input(source)
+    count = 0
+    while lexer.token():
+        count += 1
+    return count
+
+
+def bench_lexer(runs, size_mb=4):
+    # 把所有測試程式重複串接成數 MB 的輸入，比較 ply lexer 與手寫 Scanner 的吞吐量
+    import main
+    from ply.lex import lex
+
+    sample = "\n".join(load_programs())
+    source = sample * (size_mb * 1024 * 1024 // len(sample) + 1)
+    lexers = {"ply": lex(module=main), "scanner": main.Scanner()}
+    for name, lexer in lexers.items():
+        best = None
+        for _ in range(max(1, runs // 5)):
+            start = time.perf_counter()
+            count = count_tokens(lexer, source)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"lexer {name:8s} {len(source) / 1024 / 1024:.1f} MB, {count} tokens: "
+              f"{count / best / 1e6:.2f} M tokens/s")
+
+
+def bench_token_buffer(runs, size_mb=4):
+    # 比較保留 LexToken 串列與 TokenBuffer 每個 token 佔用的記憶體
+    import tracemalloc
+    import main
+
+    sample = "\n".join(load_programs())
+    source = sample * (size_mb * 1024 * 1024 // len(sample) + 1)
+    scanner = main.Scanner()
+
+    tracemalloc.start()
+    scanner.input(source)
+    token_list = list(scanner)
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    del token_list
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    buffer = main.TokenBuffer(source, scanner)
+    buffer_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    count = len(buffer)
+    print(f"token list   {list_bytes / count:6.1f} bytes/token")
+    print(f"token buffer {buffer_bytes / count:6.1f} bytes/token ({buffer.nbytes() / count:.1f} by nbytes())")
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        list(main.BufferLexer(buffer))
+    replay = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        scanner.input(source)
+        list(scanner)
+    rescan = (time.perf_counter() - start) / runs
+    print(f"re-reading {count} tokens: buffer {replay * 1000:.0f} ms, rescanning {rescan * 1000:.0f} ms")
+
+
+class FirstWriteRecorder:
+    # 記錄第一次輸出的時間，其餘輸出丟棄
+    def __init__(self):
+        self.first_write = None
+
+    def write(self, text):
+        if self.first_write is None:
+            self.first_write = time.perf_counter()
+
+    def flush(self):
+        pass
+
+
+def bench_streaming(runs):
+    # 比較一次分析整個程式與串流模式的首次輸出時間與記憶體高峰
+    import tracemalloc
+    import main
+
+    form = "(define x (+ 1 2 3))\n(print-num (* x (- 10 3)))\n"
+    for forms in (2000, 20000):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "input.txt")
+            with open(path, "w") as f:
+                f.write(form * (forms // 2))
+            for streaming in (False, True):
+                out = FirstWriteRecorder()
+                interpreter = main.Interpreter(out=out, scanner=True, streaming=streaming)
+                start = time.perf_counter()
+                interpreter.run_file(path)
+                total = time.perf_counter() - start
+                # tracemalloc 會拖慢執行，記憶體另外跑一次量測
+                tracemalloc.start()
+                interpreter.run_file(path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                mode = "stream" if streaming else "batch "
+                print(f"{mode} {forms:6d} forms: first output {(out.first_write - start) * 1000:8.1f} ms, "
+                      f"total {total * 1000:8.1f} ms, peak {peak / 1024 / 1024:6.1f} MB")
+
+
+def count_nodes(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+
+def bench_ast(runs, forms=20000):
+    # 長程式的 AST 節點數、記憶體與執行時間
+    import tracemalloc
+    import main
+
+    form = ("(define x (+ 1 2 3 4))\n"
+            "(define f (fun (a b) (if (< a b) (* a b 2) (- a b))))\n"
+            "(print-num (f x (+ x 1)))\n")
+    source = form * (forms // 3)
+    interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True)
+    tracemalloc.start()
+    ast = interpreter.parse(source)
+    ast_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = count_nodes(ast)
+    best = None
+    for _ in range(max(1, runs // 5)):
+        interpreter.reset()
+        start = time.perf_counter()
+        interpreter.execute(ast)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"ast {forms} forms: {nodes} nodes, {ast_bytes / 1024 / 1024:.1f} MB, evaluate {best * 1000:.0f} ms")
+
+
+# 數出編號不超過 2000 的完全二元樹節點，每次呼叫的引數都不同，memo 幫不上忙
+HEAP_SIZE = """
+(define heap-size
+  (fun (k)
+    (if (> k 2000) 0
+        (+ 1 (heap-size (* 2 k)) (heap-size (+ (* 2 k) 1))))))
+(print-num (heap-size 1))
+"""
+
+
+def bench_eval(runs):
+    # 以 test_data 中的 fib/fact 程式與遞迴加總量測每個後端的執行時間，每次都重設狀態以免共用 memo
+    import main
+
+    programs = {}
+    for file in ("b1_1.lsp", "b1_2.lsp"):
+        with open(os.path.join(HERE, "test_data", file), "r") as f:
+            programs[file] = f.read()
+    programs["heap-size"] = HEAP_SIZE
+    for name, source in programs.items():
+        for backend in main.BACKENDS:
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend)
+            ast = interpreter.parse(source)
+            times = []
+            for _ in range(runs):
+                interpreter.reset()
+                start = time.perf_counter()
+                interpreter.execute(ast)
+                times.append(time.perf_counter() - start)
+            print(f"eval {name:9s} {backend:8s} median {median(times) * 1000:8.2f} ms over {runs} runs")
+
+
+LOCAL_FIB = """
+(define run (fun (n)
+  (define fib (fun (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+  (fib n)))
+(print-num (run {n}))
+"""
+
+
+def bench_calls(runs):
+    # 函式內 define 的 fib 不使用 memo，每次呼叫都配置新的 frame；每次呼叫的時間應與 n 無關
+    import main
+
+    for n in (15, 18, 21):
+        source = LOCAL_FIB.format(n=n)
+        # fib 被呼叫 2 * fib(n + 1) - 1 次，再加上 run 一次
+        calls = 2 * fib(n + 1)
+        for backend in main.BACKENDS:
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend)
+            ast = interpreter.parse(source)
+            times = []
+            for _ in range(runs):
+                interpreter.reset()
+                start = time.perf_counter()
+                interpreter.execute(ast)
+                times.append(time.perf_counter() - start)
+            per_call = median(times) / calls * 1e6
+            print(f"calls fib {n:2d} {backend:8s} {calls:7d} calls median {median(times) * 1000:8.2f} ms "
+                  f"{per_call:6.2f} us/call over {runs} runs")
+
+
+SUM_TO = """
+(define sum-to (fun (n) (if (= n 0) 0 (+ n (sum-to (- n 1))))))
+(print-num (sum-to {n}))
+"""
+
+
+def bench_deep(runs, depths=(100, 10000, 1000000)):
+    # 非尾端遞迴的深度；遞迴使用 Python 堆疊的後端在深度超過限制時失敗
+    import main
+
+    for n in depths:
+        source = SUM_TO.format(n=n)
+        for backend in main.BACKENDS:
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend)
+            ast = interpreter.parse(source)
+            times = []
+            try:
+                for _ in range(runs):
+                    interpreter.reset()
+                    start = time.perf_counter()
+                    interpreter.execute(ast)
+                    times.append(time.perf_counter() - start)
+            except RecursionError:
+                print(f"deep sum-to {n:7d} {backend:9s} RecursionError")
+                continue
+            print(f"deep sum-to {n:7d} {backend:9s} median {median(times) * 1000:9.2f} ms over {runs} runs")
+
+
+def bench_expressions(runs, sizes=(1000, 10000, 100000)):
+    # 很寬的 (+ 1 1 ...) 與很深的 (+ 1 (+ 1 ...)) 的分析與執行時間，兩者都應與大小成正比；
+    # 深的運算式交給 stackless 後端，其他後端走訪 AST 時會用到 Python 的遞迴
+    import main
+
+    for shape, backend in (("wide", "tree"), ("deep", "stackless")):
+        for n in sizes:
+            if shape == "wide":
+                source = "(print-num (+ " + " 1" * n + "))\n"
+            else:
+                source = "(print-num " + "(+ 1 " * n + "0" + ")" * n + ")\n"
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend)
+            parse_times = []
+            eval_times = []
+            for _ in range(runs):
+                interpreter.reset()
+                start = time.perf_counter()
+                ast = interpreter.parse(source)
+                parse_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                interpreter.execute(ast)
+                eval_times.append(time.perf_counter() - start)
+            print(f"expressions {shape} {n:6d} {backend:9s} parse {median(parse_times) * 1000:8.2f} ms "
+                  f"evaluate {median(eval_times) * 1000:8.2f} ms over {runs} runs")
+
+
+# 每個 n 先用便宜的條件過濾，再呼叫代價與 n 成正比的 check；check 的引數都不同，memo 幫不上忙
+GUARDS = """
+(define check (fun (k) (if (< k 1) #t (check (- k 3)))))
+(define count (fun (n acc)
+  (if (= n 0) acc
+      (count (- n 1) (if (and (= (mod n 5) 0) (check n)) (+ acc 1) acc)))))
+(print-num (count 1500 0))
+"""
+
+
+def bench_logic(runs):
+    # 短路的 and/or 與 strict 模式（計算所有運算元）的比較
+    import main
+
+    for backend in main.BACKENDS:
+        for strict in (False, True):
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend, strict=strict)
+            ast = interpreter.parse(GUARDS)
+            times = []
+            for _ in range(runs):
+                interpreter.reset()
+                start = time.perf_counter()
+                interpreter.execute(ast)
+                times.append(time.perf_counter() - start)
+            mode = "strict" if strict else "short-circuit"
+            print(f"logic guards {backend:9s} {mode:13s} median {median(times) * 1000:8.2f} ms over {runs} runs")
+
+
+# 熱迴圈中的常數子運算式
+CONSTANTS = """
+(define seconds (fun (n acc)
+  (if (= n 0) acc
+      (seconds (- n 1) (+ acc (* 60 60 24) (if (> 2 1) (- (+ 1 2 3) 6) (* 2 2)) (if (and #t (not #f)) 1 0))))))
+(print-num (seconds 20000 0))
+"""
+
+
+def bench_fold(runs):
+    # 常數摺疊開啟與關閉的比較，parse 包含摺疊的時間
+    import main
+
+    for backend in main.BACKENDS:
+        for fold in (True, False):
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend, fold=fold)
+            times = []
+            for _ in range(runs):
+                interpreter.reset()
+                start = time.perf_counter()
+                interpreter.execute(interpreter.parse(CONSTANTS))
+                times.append(time.perf_counter() - start)
+            mode = "fold" if fold else "no fold"
+            print(f"fold constants {backend:9s} {mode:7s} median {median(times) * 1000:8.2f} ms over {runs} runs")
+
+
+HELPERS = """
+(define square (fun (x) (* x x)))
+(define dist (fun (a b) (if (> a b) (- a b) (- b a))))
+(define step (fun (n acc) (+ acc (square n) (dist n 50))))
+(define walk (fun (n acc) (if (= n 0) acc (walk (- n 1) (step n acc)))))
+(print-num (walk 20000 0))
+"""
+
+
+def bench_inline(runs):
+    # 小函式展開開啟與關閉的比較，run() 包含分析與展開的時間
+    import main
+
+    for backend in main.BACKENDS:
+        for inline in (main.INLINE_THRESHOLD, 0):
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend, inline=inline)
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                interpreter.run(HELPERS)
+                times.append(time.perf_counter() - start)
+            mode = "inline" if inline else "calls"
+            print(f"inline helpers {backend:9s} {mode:6s} median {median(times) * 1000:8.2f} ms over {runs} runs")
+
+
+NUMERIC = """
+(define loop (fun (i acc)
+  (if (= i 0) acc
+      (loop (- i 1) (+ acc (mod (* i i) 7) (if (and (> i 5) (not (= i 9))) 1 0))))))
+(print-num (loop 20000 0))
+"""
+
+
+def bench_types(runs):
+    # 型別推導開啟與關閉的比較，以及 tree 與 stackless 實際執行的型別檢查次數
+    import main
+
+    for backend in main.BACKENDS:
+        for infer in (True, False):
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend, infer=infer)
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                interpreter.run(NUMERIC)
+                times.append(time.perf_counter() - start)
+            mode = "infer" if infer else "checks"
+            print(f"numeric types  {backend:9s} {mode:6s} median {median(times) * 1000:8.2f} ms over {runs} runs, "
+                  f"{interpreter.type_checks} type checks")
+
+
+GLOBAL_FIB = """
+(define fib (fun (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+(print-num (fib 20))
+"""
+
+
+def bench_memo(runs):
+    # 全域函式的呼叫結果快取：開啟時 fib 只計算每個 n 一次；
+    # 長時間執行時快取的筆數不超過上限，最久沒用到的結果被淘汰
+    import main
+
+    for backend in main.BACKENDS:
+        for size in (main.MEMO_SIZE, 0):
+            interpreter = main.Interpreter(out=FirstWriteRecorder(), scanner=True, backend=backend, memo_size=size)
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                interpreter.run(GLOBAL_FIB)
+                times.append(time.perf_counter() - start)
+            stats = interpreter.memo.stats()
+            print(f"memo fib 20 {backend:9s} size {size:5d} median {median(times) * 1000:8.2f} ms over {runs} runs, "
+                  f"{stats['hits']} hits {stats['misses']} misses")
+    interpreter = main.Interpreter(memo_size=1000)
+    interpreter.eval("(define double (fun (x) (* 2 x))) (define f (fun (x) (double x)))")
+    for i in range(5000):
+        interpreter.eval(f"(f {i})")
+    stats = interpreter.memo.stats()
+    print(f"memo 5000 evals size {stats['size']}: {stats['entries']} entries, {stats['evictions']} evictions")
+
+
+def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "lexer": bench_lexer,
+    "tokens": bench_token_buffer,
+    "streaming": bench_streaming,
+    "ast": bench_ast,
+    "eval": bench_eval,
+    "calls": bench_calls,
+    "deep": bench_deep,
+    "expressions": bench_expressions,
+    "logic": bench_logic,
+    "fold": bench_fold,
+    "inline": bench_inline,
+    "types": bench_types,
+    "memo": bench_memo,
+}
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Mini-LISP benchmarks")
+    arg_parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    arg_parser.add_argument("--runs", type=int, default=10)
+    args = arg_parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            arg_parser.error(f"unknown benchmark {name!r}")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args.runs)
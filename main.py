@@ -1,22 +1,65 @@
 # Mini-Lisp Interpreter
 
-from ply.lex import lex
+from ply.lex import lex, LexToken
 from ply.yacc import yacc
-from collections import deque, defaultdict
+from array import array
+from collections import deque, defaultdict, OrderedDict
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import re
+import sys
+import time
 
-import networkx as nx
-import matplotlib.pyplot as plt
-from copy import deepcopy
 
 IS_DEBUG = False
+# 輸出各階段耗時的 JSON 報告到 stderr，也可以用 python main.py --timing 開啟
+IS_TIMING = False
+# 逐一執行最上層的敘述：每讀完一個敘述就執行並輸出，之後釋放它的 AST，也可以用 --stream 開啟
+IS_STREAMING = False
+# and/or 預設短路：結果確定之後不再計算其餘的運算元，只檢查已計算的運算元型別是否相同；
+# strict 模式和舊版一樣先計算所有運算元、檢查型別再合併，也可以用 --strict 開啟
+IS_STRICT = False
+# 執行後端：'tree' 直接走訪 AST，'stackless' 以明確的工作堆疊走訪 AST，遞迴深度不受 Python 限制，
+# 'closure' 先把 AST 編譯成 closure，'bytecode' 編譯成 bytecode 交給 VM 執行，'python' 翻譯成 Python 原始碼交給 CPython 執行
+# 每個後端的結果都和 tree（travel_ast）相同，test_data.py 逐一比對：
+#   運算元由左到右全部計算完之後才檢查型別；呼叫先計算引數再找函式，所以引數的型別錯誤先於未定義的函式
+#   引數比參數少時由 arity_error() 拋出 MiniLispArityError，多出來的引數忽略
+#   函式內尚未 define 的位置是 None；fun 運算式只有在呼叫時才會用到，單獨出現時沒有值
+#   只有全域函式使用 Interpreter.memo；尾端呼叫只查詢 memo，結果記在最外層的呼叫
+BACKEND = 'tree'
+BACKENDS = ('tree', 'stackless', 'closure', 'bytecode', 'python')
+# 執行完整的程式前，把本體不超過這個節點數的小函式在呼叫處展開，0 表示不展開，也可以用 --inline=N 設定
+INLINE_THRESHOLD = 16
+# 具名函式呼叫結果的快取最多保留的筆數，0 表示不快取，也可以用 --memo-size=N 設定
+MEMO_SIZE = 10000
+# 快取 LALR 分析表，避免每次啟動都重新建表
+PARSER_TABLE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parsetab.pickle')
+# 快取驗證過的詞法規則，避免每次啟動都重新反射與編譯
+LEXER_TABLE_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lextab.pickle')
 
 
 # --- Lexer ---
+# AST 的節點種類，op 是種類在此表中的位置，Interpreter 以 op 查表分派到 eval_<種類> 方法
+NODE_TYPES = (
+    'PROGRAM', 'PLUS', 'MINUS', 'MUL', 'DIV', 'MOD', 'GREATER', 'LESS', 'EQUAL', 'AND', 'OR', 'NOT',
+    'PRINT_NUM', 'PRINT_BOOL', 'NUMBER', 'BOOL', 'IF_EXP', 'DEF', 'VARIABLE',
+    'FUN_CALL_ANONYMOUS', 'FUN_CALL_DEFINED', 'FUN_EXP',
+)
+OPCODES = {node_type: op for op, node_type in enumerate(NODE_TYPES)}
+
+
 class Node:
     node_counter = 0
 
     def __init__(self, node_type, children=None, value=None):
         self.type = node_type
+        self.op = OPCODES[node_type]
+        # VARIABLE、FUN_CALL_DEFINED 與函式內的 DEF 由 resolve() 填入 (depth, index)，None 表示全域
+        self.address = None
+        # infer_types() 證明的值的型別（int 或 bool），None 表示未知；proven 表示執行時的型別檢查一定通過，可以省略
+        self.value_type = None
+        self.proven = False
         self.value = value
         self.parent = None
         self.id = Node.node_counter
@@ -73,16 +116,13 @@ t_ignore = ' \t\n\r'
 
 def t_NUMBER(t):
     r'0|[1-9][0-9]*|\-[1-9][0-9]*'
-    t.value = Node('NUMBER', value=int(t.value))
+    t.value = int(t.value)
     return t
 
 
 def t_BOOL(t):
     r'\#t|\#f'
-    if t.value == '#t':
-        t.value = Node('BOOL', value=True)
-    else:
-        t.value = Node('BOOL', value=False)
+    t.value = t.value == '#t'
     return t
 
 
@@ -91,7 +131,8 @@ def t_ID(t):
     # 特別小心對關鍵字的影響
     t.type = reserved.get(t.value, 'ID')  # Check for reserved words
     if t.type == 'ID':
-        t.value = Node('ID', value=t.value)
+        # 相同名稱的識別字共用同一個字串物件
+        t.value = sys.intern(t.value)
     return t
 
 
@@ -100,46 +141,314 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-lexer = lex()
-input_file = open("input.txt", "r")
-data = input_file.read()
-lexer.input(data)
-
-# Tokenize
-if IS_DEBUG:
-    print("Tokens:")
+# 手寫的單趟掃描器，產生與 ply 相同的 token 串流，但不經過 master regex 與 t_ callback
+# 依照第一個字元決定 token 種類，只有數字與識別字需要再往後比對
+SINGLE_CHAR_TOKENS = {
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    '+': 'PLUS',
+    '*': 'MUL',
+    '/': 'DIV',
+    '>': 'Greater',
+    '<': 'Less',
+    '=': 'Equal',
+}
+NUMBER_RE = re.compile(r'0|[1-9][0-9]*|\-[1-9][0-9]*')
+ID_RE = re.compile(r'[a-z][a-z0-9\-]*')
+
+
+class Scanner:
+    def __init__(self):
+        self.lexdata = None
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lineno = 1
+
+    def input(self, s):
+        self.lexdata = s
+        self.lexpos = 0
+        self.lexlen = len(s)
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def token(self, ignore=t_ignore, single_char_tokens=SINGLE_CHAR_TOKENS, LexToken=LexToken, intern=sys.intern):
+        # 預設參數把常用的全域名稱變成區域變數，減少查找成本
+        data = self.lexdata
+        pos = self.lexpos
+        length = self.lexlen
+        while pos < length:
+            c = data[pos]
+            if c in ignore:
+                pos += 1
+                continue
+            tok = LexToken()
+            tok.lineno = self.lineno
+            tok.lexpos = pos
+            tok_type = single_char_tokens.get(c)
+            if tok_type is not None:
+                tok.type = tok_type
+                tok.value = c
+                self.lexpos = pos + 1
+                return tok
+            if 'a' <= c <= 'z':
+                end = ID_RE.match(data, pos).end()
+                text = data[pos:end]
+                tok.type = reserved.get(text, 'ID')
+                if tok.type == 'ID':
+                    tok.value = intern(text)
+                else:
+                    tok.value = text
+                self.lexpos = end
+                return tok
+            if '0' <= c <= '9' or (c == '-' and '1' <= data[pos + 1:pos + 2] <= '9'):
+                end = NUMBER_RE.match(data, pos).end()
+                tok.type = 'NUMBER'
+                tok.value = int(data[pos:end])
+                self.lexpos = end
+                return tok
+            if c == '-':
+                tok.type = 'MINUS'
+                tok.value = c
+                self.lexpos = pos + 1
+                return tok
+            if c == '#' and data[pos + 1:pos + 2] in ('t', 'f'):
+                tok.type = 'BOOL'
+                tok.value = data[pos + 1] == 't'
+                self.lexpos = pos + 2
+                return tok
+            # 與 t_error 相同：印出錯誤並跳過一個字元
+            print("Illegal character '%s'" % c)
+            pos += 1
+        self.lexpos = pos + 1
+        return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
+
+
+# 分段讀檔時每次讀入的字元數
+CHUNK_SIZE = 1 << 20
+# token 不會跨越這些字元，區塊在最後一個分隔字元之後切開就不會切斷 token
+TOKEN_DELIMITERS = t_ignore + '()'
+
+
+class ChunkScanner(Scanner):
+    # 從檔案分段讀取原始碼的 Scanner，同一時間只保留一個區塊，lexpos 仍是整個檔案中的位置
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        super().__init__()
+        self.file = file
+        self.chunk_size = chunk_size
+        # 目前區塊在檔案中的起點，以及上一個區塊切開後留下的尾巴
+        self.base = 0
+        self.carry = ''
+        self.eof = False
+        self.input('')
+
+    def refill(self):
+        self.base += self.lexlen
+        data = self.carry
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                cut = len(data)
+                break
+            data += chunk
+            cut = max(data.rfind(c) for c in TOKEN_DELIMITERS) + 1
+            if cut > 0:
+                break
+        self.carry = data[cut:]
+        self.input(data[:cut])
+
+    def token(self):
+        while True:
+            tok = Scanner.token(self)
+            if tok is not None:
+                tok.lexpos += self.base
+                return tok
+            if self.eof:
+                return None
+            self.refill()
+
+
+def top_level_forms(lexer):
+    # 依括號深度把 token 串流切成最上層的敘述，每次只保留一個敘述的 token
+    form = []
+    depth = 0
     while True:
         tok = lexer.token()
         if not tok:
             break
-        print(tok.type, tok.value)
+        form.append(tok)
+        if tok.type == 'LPAREN':
+            depth += 1
+        elif tok.type == 'RPAREN':
+            depth -= 1
+        if depth <= 0:
+            # 多出來的右括號也單獨成為一段，交給語法分析器回報錯誤
+            yield form
+            form = []
+            depth = 0
+    if form:
+        # 括號沒有閉合的最後一段
+        yield form
+
+
+class FormLexer:
+    # 把一個敘述的 token 串列交給語法分析器
+    def __init__(self, form):
+        self.tokens = iter(form)
+
+    def token(self):
+        return next(self.tokens, None)
+
+
+# TokenBuffer 以欄位式陣列保存整個檔案的 token，每個 token 只佔十幾個位元組，
+# 不必為每個 token 保留一個 LexToken 物件，同一份原始碼也可以重複分析而不必重新掃描
+TOKEN_KINDS = {name: kind for kind, name in enumerate(tokens)}
+# 關鍵字與符號的 token 值是固定的字串
+FIXED_TOKEN_VALUES = [None] * len(tokens)
+for _text, _name in list(reserved.items()) + list(SINGLE_CHAR_TOKENS.items()) + [('-', 'MINUS')]:
+    FIXED_TOKEN_VALUES[TOKEN_KINDS[_name]] = _text
+KIND_NUMBER = TOKEN_KINDS['NUMBER']
+KIND_BOOL = TOKEN_KINDS['BOOL']
+KIND_ID = TOKEN_KINDS['ID']
+
+
+class TokenBuffer:
+    def __init__(self, source, lexer):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        # 只有 ID 與 NUMBER 會在 value_ids 佔一格，指向 values 中去除重複後的值
+        self.value_ids = array('I')
+        self.values = []
+        self.lineno = lexer.lineno
+        self.fill(lexer)
+
+    def fill(self, lexer):
+        kinds, starts, ends, value_ids, values = self.kinds, self.starts, self.ends, self.value_ids, self.values
+        value_table = {}
+        lexer.input(self.source)
+        while True:
+            tok = lexer.token()
+            if not tok:
+                break
+            kind = TOKEN_KINDS[tok.type]
+            kinds.append(kind)
+            starts.append(tok.lexpos)
+            ends.append(lexer.lexpos)
+            if kind == KIND_ID or kind == KIND_NUMBER:
+                value_id = value_table.get(tok.value)
+                if value_id is None:
+                    value_id = value_table[tok.value] = len(values)
+                    values.append(tok.value)
+                value_ids.append(value_id)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return iter(BufferLexer(self))
+
+    def nbytes(self):
+        # 陣列與值表佔用的記憶體，不含原始碼本身
+        return (sum(sys.getsizeof(column) for column in (self.kinds, self.starts, self.ends, self.value_ids))
+                + sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values))
+
+
+class BufferLexer:
+    # 讓 ply 的語法分析器從 TokenBuffer 讀取 token。語法分析器只讀取 token 的 type 與 value，
+    # 所以同一種關鍵字或符號、同一個真假值、值表中的同一個 ID 或 NUMBER 共用一個 LexToken，重播時不逐一建立；
+    # 共用的 token 沒有各自的位置（lexpos 是 None），目前的位置在 lexer 的 lexpos，起點在 TokenBuffer.starts
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.index = 0
+        self.value_index = 0
+        self.lineno = buffer.lineno
+        self.lexpos = 0
+        self.fixed_tokens = [self.shared_token(kind, value) for kind, value in enumerate(FIXED_TOKEN_VALUES)]
+        self.bool_tokens = (self.shared_token(KIND_BOOL, False), self.shared_token(KIND_BOOL, True))
+        # 值表中的值第一次出現時才建立
+        self.value_tokens = [None] * len(buffer.values)
+
+    def shared_token(self, kind, value):
+        tok = LexToken()
+        tok.type = tokens[kind]
+        tok.value = value
+        tok.lineno = self.lineno
+        tok.lexpos = None
+        return tok
+
+    def input(self, s):
+        # 內容已經在 TokenBuffer 中，只需要回到開頭
+        self.index = 0
+        self.value_index = 0
+        self.lexpos = 0
+
+    def token(self):
+        buffer = self.buffer
+        index = self.index
+        if index >= len(buffer.kinds):
+            return None
+        kind = buffer.kinds[index]
+        if kind == KIND_ID or kind == KIND_NUMBER:
+            value_id = buffer.value_ids[self.value_index]
+            self.value_index += 1
+            tok = self.value_tokens[value_id]
+            if tok is None:
+                tok = self.value_tokens[value_id] = self.shared_token(kind, buffer.values[value_id])
+        elif kind == KIND_BOOL:
+            tok = self.bool_tokens[buffer.source[buffer.starts[index] + 1] == 't']
+        else:
+            tok = self.fixed_tokens[kind]
+        self.lexpos = buffer.ends[index]
+        self.index = index + 1
+        return tok
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
 
-    print('---' * 10)
 
 # --- Parser ---
 # Parsing rules
-
-IS_VALID_SYNTAX = True
+# AST 是扁平的：程式、多元運算子與函式呼叫都直接以串列保存子節點，沒有只包一層的節點
 
 
 def p_PROGRAM(p):
     """
     PROGRAM : STMTS
     """
-    p[0] = p[1]
-    if IS_VALID_SYNTAX and IS_DEBUG:
-        print("Accepted")
+    for stmt in p[1]:
+        resolve(stmt)
+    p[0] = Node('PROGRAM', p[1])
 
 
 def p_STMTS(p):
     """
     STMTS : STMT
-          | STMT STMTS
+          | STMTS STMT
     """
+    # 左遞迴：分析器的堆疊不會隨敘述個數成長，串列依原本的順序收集
     if len(p) == 2:
-        p[0] = p[1]
+        p[0] = [p[1]]
     else:
-        p[0] = Node('STMTS', [p[1], p[2]])
+        p[1].append(p[2])
+        p[0] = p[1]
 
 
 def p_STMT(p):
@@ -166,25 +475,35 @@ def p_EXP(p):
     """
     EXP : NUMBER
         | BOOL
-        | VARIABLE
+        | ID
         | NUM_OP
         | LOGICAL_OP
         | FUN_EXP
         | FUN_CALL
         | IF_EXP
     """
-    p[0] = p[1]
+    match p.slice[1].type:
+        case 'NUMBER':
+            p[0] = Node('NUMBER', value=p[1])
+        case 'BOOL':
+            p[0] = Node('BOOL', value=p[1])
+        case 'ID':
+            p[0] = Node('VARIABLE', value=p[1])
+        case _:
+            p[0] = p[1]
 
 
 def p_EXPS(p):
     """
     EXPS : EXP
-         | EXP EXPS
+         | EXPS EXP
     """
+    # 左遞迴：分析器的堆疊不會隨運算元個數成長
     if len(p) == 2:
-        p[0] = p[1]
+        p[0] = [p[1]]
     else:
-        p[0] = Node('EXPS', [p[1], p[2]])
+        p[1].append(p[2])
+        p[0] = p[1]
 
 
 def p_NUM_OP(p):
@@ -200,12 +519,11 @@ def p_NUM_OP(p):
     """
     match p[2]:
         case '+':
-            p[0] = Node('PLUS', [p[3], p[4]])
-            # print(p[0].children)
+            p[0] = Node('PLUS', operands(p[3], p[4]))
         case '-':
             p[0] = Node('MINUS', [p[3], p[4]])
         case '*':
-            p[0] = Node('MUL', [p[3], p[4]])
+            p[0] = Node('MUL', operands(p[3], p[4]))
         case '/':
             p[0] = Node('DIV', [p[3], p[4]])
         case '>':
@@ -213,7 +531,7 @@ def p_NUM_OP(p):
         case '<':
             p[0] = Node('LESS', [p[3], p[4]])
         case '=':
-            p[0] = Node('EQUAL', [p[3], p[4]])
+            p[0] = Node('EQUAL', operands(p[3], p[4]))
         case 'mod':
             p[0] = Node('MOD', [p[3], p[4]])
 
@@ -226,554 +544,3046 @@ def p_LOGICAL_OP(p):
     """
     match p[2]:
         case 'and':
-            p[0] = Node('AND', [p[3], p[4]])
+            p[0] = Node('AND', operands(p[3], p[4]))
         case 'or':
-            p[0] = Node('OR', [p[3], p[4]])
+            p[0] = Node('OR', operands(p[3], p[4]))
         case 'not':
             p[0] = Node('NOT', [p[3]])
 
 
-def p_DEF_STMT(p):
-    """
-    DEF_STMT : LPAREN DEF VARIABLE EXP RPAREN
-             | LPAREN DEF FUN_NAME FUN_EXP RPAREN
-    """
-    # 語法可能還要再修改，TEMP FIXED
-    if p[4].type == 'FUN_EXP':
-        p[3].type = 'FUN_NAME'
-    p[0] = Node('DEF', [p[3], p[4]])
+def operands(first, rest):
+    # rest 是 EXPS 依序收集的串列
+    rest.insert(0, first)
+    return rest
 
 
-def p_VARIABLE(p):
+def p_DEF_STMT(p):
     """
-    VARIABLE : ID
+    DEF_STMT : LPAREN DEF ID EXP RPAREN
     """
-    p[0] = Node('VARIABLE', [p[1]])
+    # 值是 FUN_EXP 時為函式定義，否則為變數定義
+    p[0] = Node('DEF', [p[4]], value=p[3])
 
 
 def p_VARIABLES(p):
     """
-    VARIABLES : VARIABLE VARIABLES
+    VARIABLES : VARIABLES ID
               | empty
     """
     if len(p) == 3:
-        p[0] = Node('VARIABLES', [p[1], p[2]])
+        p[1].append(p[2])
+        p[0] = p[1]
     else:
-        p[0] = Node('NULL')
+        p[0] = []
 
 
 def p_FUN_EXP(p):
     """
-    FUN_EXP : LPAREN FUN FUN_IDs FUN_BODY RPAREN
+    FUN_EXP : LPAREN FUN LPAREN VARIABLES RPAREN FUN_BODY RPAREN
     """
-    p[0] = Node('FUN_EXP', [p[3], p[4]])
-
-
-def p_FUN_NAME(p):
-    """
-    FUN_NAME : ID
-    """
-    p[0] = Node('FUN_NAME', [p[1]])
-
-
-def p_FUN_IDs(p):
-    """
-    FUN_IDs : LPAREN VARIABLES RPAREN
-    """
-    p[0] = Node('FUN_IDs', [p[2]])
+    # 參數名稱放在 value，子節點依序是函式內的定義，最後一個是函式本體
+    p[6].reverse()
+    p[0] = Node('FUN_EXP', p[6], value=tuple(p[4]))
 
 
 def p_FUN_BODY(p):
     """
     FUN_BODY : EXP
+             | DEF_STMT FUN_BODY
     """
-    p[0] = Node('FUN_BODY', [p[1]])
-
-
-def p_PARAM(p):
-    """
-    PARAM : EXP
-    """
-    p[0] = Node('PARAM', [p[1]])
+    # 函式本體前面可以有任意個 define（巢狀函式或區域變數）
+    # 右遞迴會先歸約最後的本體，所以往尾端附加得到反向的串列，由 p_FUN_EXP 反轉，避免每層複製串列
+    if len(p) == 2:
+        p[0] = [p[1]]
+    else:
+        p[2].append(p[1])
+        p[0] = p[2]
 
 
 def p_PARAMS(p):
     """
-    PARAMS : PARAM PARAMS
+    PARAMS : PARAMS EXP
            | empty
     """
     if len(p) == 3:
-        p[0] = Node('PARAMS', [p[1], p[2]])
+        p[1].append(p[2])
+        p[0] = p[1]
     else:
-        p[0] = Node('NULL')
+        p[0] = []
 
 
 def p_FUN_CALL(p):
     """
     FUN_CALL : LPAREN FUN_EXP PARAMS RPAREN
-             | LPAREN FUN_NAME PARAMS RPAREN
+             | LPAREN ID PARAMS RPAREN
     """
-    if p[2].type == 'FUN_EXP':
-        p[0] = Node('FUN_CALL_ANONYMOUS', [p[2], p[3]])
+    # 子節點依序是引數；匿名函式呼叫的第一個子節點是 FUN_EXP
+    if p.slice[2].type == 'FUN_EXP':
+        p[0] = Node('FUN_CALL_ANONYMOUS', [p[2]] + p[3])
     else:
-        p[0] = Node('FUN_CALL_DEFINED', [p[2], p[3]])
+        p[0] = Node('FUN_CALL_DEFINED', p[3], value=p[2])
 
 
 def p_IF_EXP(p):
     """
-    IF_EXP : LPAREN IF TEST_EXP THAN_EXP ELSE_EXP RPAREN
+    IF_EXP : LPAREN IF EXP EXP EXP RPAREN
     """
+    # 子節點依序是 test、then、else
     p[0] = Node('IF_EXP', [p[3], p[4], p[5]])
 
 
-def p_TEST_EXP(p):
+def p_empty(p):
     """
-    TEST_EXP : EXP
+    empty :
     """
-    p[0] = Node('TEST_EXP', [p[1]])
+    pass
 
 
-def p_THAN_EXP(p):
+def resolve(node: Node, scopes=()):
     """
-    THAN_EXP : EXP
+    決定每個變數在執行時的位置：VARIABLE 與函式內的 DEF 的 address 設為 (depth, index)，
+    表示往外第 depth 層函式的第 index 個位置（先是參數，接著是函式內的 define），找不到就保持 None 表示全域。
+    FUN_CALL_DEFINED 只會對應到函式內 define 的函式，否則呼叫 function_dict 中的全域函式。
+    scopes 由外到內，每層是 名稱 -> (index, 是否為函式) 的 dict。
+    以明確的堆疊走訪，巢狀很深的運算式也不會用到 Python 的遞迴。
     """
-    p[0] = Node('THAN_EXP', [p[1]])
-
-
-def p_ELSE_EXP(p):
+    pending = [(node, scopes)]
+    while pending:
+        node, scopes = pending.pop()
+        if node.type == 'VARIABLE' or node.type == 'FUN_CALL_DEFINED':
+            depth = 0
+            for scope in reversed(scopes):
+                if node.value in scope and (node.type == 'VARIABLE' or scope[node.value][1]):
+                    node.address = (depth, scope[node.value][0])
+                    break
+                depth += 1
+        if node.type == 'FUN_EXP':
+            # 參數重複時以最後一個為準
+            scope = {param: (index, False) for index, param in enumerate(node.value)}
+            index = len(node.value)
+            for define in node.children[:-1]:
+                define.address = (0, index)
+                scope[define.value] = (index, define.children[0].type == 'FUN_EXP')
+                index += 1
+            scopes = scopes + (scope,)
+        for child in node.children:
+            pending.append((child, scopes))
+
+
+# fold_constants() 可以直接算出結果的運算
+CONSTANT_OPERATORS = ('PLUS', 'MINUS', 'MUL', 'DIV', 'MOD', 'GREATER', 'LESS', 'EQUAL', 'AND', 'OR', 'NOT')
+
+
+def fold_constants(node: Node, strict=False):
     """
-    ELSE_EXP : EXP
+    常數摺疊：運算元全部是 NUMBER/BOOL 的運算直接換成計算結果，test 是 BOOL 的 IF_EXP 換成會執行的分支。
+    計算時會拋出例外（型別錯誤、除以零）的運算保持原樣，錯誤仍在原本執行到的時候發生。
+    strict 與 Interpreter 的 strict 相同，決定 and/or 的計算方式。節點就地修改。
     """
-    p[0] = Node('ELSE_EXP', [p[1]])
-
-
-def p_empty(p):
+    # 先序走訪的相反順序：子節點一定比父節點先處理
+    order = []
+    pending = [node]
+    while pending:
+        cur = pending.pop()
+        order.append(cur)
+        pending.extend(cur.children)
+    for cur in reversed(order):
+        if cur.type == 'IF_EXP':
+            test = cur.children[0]
+            if test.type == 'BOOL':
+                taken = cur.children[1] if test.value else cur.children[2]
+                cur.type = taken.type
+                cur.op = taken.op
+                cur.value = taken.value
+                cur.children = taken.children
+                cur.address = taken.address
+        elif cur.type in CONSTANT_OPERATORS:
+            if all(child.type == 'NUMBER' or child.type == 'BOOL' for child in cur.children):
+                try:
+                    value = constant_value(cur.type, [child.value for child in cur.children], strict)
+                except (TypeError, ArithmeticError):
+                    continue
+                cur.type = 'BOOL' if type(value) is bool else 'NUMBER'
+                cur.op = OPCODES[cur.type]
+                cur.value = value
+                cur.children = []
+    return node
+
+
+def constant_value(node_type, values, strict):
+    # 在分析時計算常數運算式，計算與型別檢查和執行時相同
+    if node_type == 'NOT':
+        if type(values[0]) is not bool:
+            raise TypeError
+        return not values[0]
+    value_type = type(values[0])
+    if node_type in ('AND', 'OR') and not strict:
+        res = values[0]
+        for value in values[1:]:
+            if bool(res) is not (node_type == 'AND'):
+                break
+            res = value
+            if type(res) is not value_type:
+                raise TypeError
+        return res
+    for value in values:
+        if type(value) is not value_type:
+            raise TypeError
+    if node_type == 'PLUS':
+        res = 0
+        for value in values:
+            res += value
+        return res
+    elif node_type == 'MUL':
+        res = 1
+        for value in values:
+            res *= value
+        return res
+    elif node_type == 'EQUAL':
+        return all(value == values[0] for value in values)
+    elif node_type == 'AND':
+        res = True
+        for value in values:
+            res = res and value
+        return res
+    elif node_type == 'OR':
+        res = False
+        for value in values:
+            res = res or value
+        return res
+    exp1, exp2 = values
+    if node_type == 'MINUS':
+        return exp1 - exp2
+    elif node_type == 'DIV':
+        return exp1 // exp2
+    elif node_type == 'MOD':
+        return exp1 % exp2
+    elif node_type == 'GREATER':
+        return exp1 > exp2
+    return exp1 < exp2
+
+
+def subtree(node: Node):
+    # 以明確的堆疊先序走訪，回傳 node 與所有子孫節點
+    nodes = []
+    pending = [node]
+    while pending:
+        cur = pending.pop()
+        nodes.append(cur)
+        pending.extend(reversed(cur.children))
+    return nodes
+
+
+def copy_tree(node: Node):
+    # 以明確的堆疊複製 node 的子樹，保留 resolve() 的位址
+    root = []
+    pending = [(node, root)]
+    while pending:
+        src, siblings = pending.pop()
+        copied = Node(src.type, value=src.value)
+        copied.address = src.address
+        siblings.append(copied)
+        for child in reversed(src.children):
+            pending.append((child, copied.children))
+    return root[0]
+
+
+def inline_functions(program: Node, threshold=INLINE_THRESHOLD, originals=None):
     """
-    empty :
+    把小的全域函式在呼叫處展開成函式本體，參數換成呼叫的引數。
+    只展開整個程式中只定義一次、沒有函式內的 define 與 fun、不會直接或間接呼叫自己，
+    且本體不超過 threshold 個節點的函式；只展開定義之後的敘述中、引數個數與參數相同的呼叫。
+    引數仍然依序各計算一次，見 substitution_safe()。
+    program 必須是已經 resolve() 的完整程式，之後不會再有其他定義。節點就地修改，
+    回傳展開的呼叫處，每項是 (函式名稱, 呼叫處所在的全域函式名稱或 None, 第幾個敘述)。
+    originals 不是 None 時，有呼叫處要展開的全域函式定義先複製一份，以 DEF 節點為 key 存進 originals。
+    """
+    defines = defaultdict(list)
+    for stmt in program.children:
+        if stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP':
+            defines[stmt.value].append(stmt)
+    # 每個全域函式（所有定義合起來）直接呼叫的全域函式
+    callees = {
+        name: {node.value for stmt in stmts for node in subtree(stmt)
+               if node.type == 'FUN_CALL_DEFINED' and node.address is None}
+        for name, stmts in defines.items()
+    }
+    candidates = {}
+    # 前面的敘述已經定義的全域變數，讀取它們不會失敗
+    defined = set()
+    sites = []
+    for number, stmt in enumerate(program.children, 1):
+        is_function = stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP'
+        nodes = subtree(stmt)
+        if is_function and originals is not None and any(
+                node.type == 'FUN_CALL_DEFINED' and node.address is None and node.value in candidates
+                for node in nodes):
+            originals[stmt] = copy_tree(stmt)
+        for cur in reversed(nodes):
+            # 子節點先展開，引數中的呼叫展開後可能變成常數
+            expand_call(cur, candidates, defined, (stmt.value if is_function else None, number), sites)
+        if is_function:
+            fun_exp = stmt.children[0]
+            if (len(defines[stmt.value]) == 1 and len(fun_exp.children) == 1
+                    and not is_recursive(stmt.value, callees)):
+                body = subtree(fun_exp.children[0])
+                if len(body) <= threshold and all(node.type != 'FUN_EXP' for node in body):
+                    candidates[stmt.value] = fun_exp
+        elif stmt.type == 'DEF':
+            defined.add(stmt.value)
+    return sites
+
+
+def is_recursive(name, callees):
+    # name 是否會經由其他全域函式呼叫回自己
+    seen = set()
+    pending = list(callees[name])
+    while pending:
+        callee = pending.pop()
+        if callee == name:
+            return True
+        if callee not in seen and callee in callees:
+            seen.add(callee)
+            pending.extend(callees[callee])
+    return False
+
+
+def expand_call(cur: Node, candidates, defined, site, sites):
+    if cur.type != 'FUN_CALL_DEFINED' or cur.address is not None or cur.value not in candidates:
+        return
+    fun_exp = candidates[cur.value]
+    args = cur.children
+    if len(args) != len(fun_exp.value) or not substitution_safe(fun_exp.children[0], args, defined):
+        return
+    name = cur.value
+    body, copied = copy_body(fun_exp.children[0], args)
+    cur.type = body.type
+    cur.op = body.op
+    cur.value = body.value
+    cur.children = body.children
+    cur.address = body.address
+    sites.append((name,) + site)
+    # 本體中呼叫的是定義在 name 之後的函式時，現在也可能可以展開
+    for node in reversed(copied[1:]):
+        expand_call(node, candidates, defined, site, sites)
+    if copied and copied[0] is body:
+        expand_call(cur, candidates, defined, site, sites)
+
+
+def substitution_safe(body: Node, args, defined):
+    """
+    引數代入本體之後，計算的結果、次數與可能發生的錯誤是否和先計算引數再執行本體相同。
+    常數、區域變數與已定義的全域變數不會失敗，可以代入任意多次；其他引數必須在本體中各出現一次，
+    並且依引數的順序出現在第一個可能失敗或分支的計算（型別檢查、呼叫、讀取全域變數、if 與 and/or 的第一個運算元之後）之前。
     """
+    delayed = [index for index, arg in enumerate(args)
+               if not (arg.type == 'NUMBER' or arg.type == 'BOOL' or arg.type == 'VARIABLE'
+                       and (arg.address is not None or arg.value in defined))]
+    if not delayed:
+        return True
+    # 依計算順序列出本體中讀取的參數位置，None 表示可能失敗或分支的計算
+    events = []
+    pending = [body]
+    while pending:
+        cur = pending.pop()
+        if cur is None:
+            events.append(None)
+        elif cur.type == 'VARIABLE':
+            events.append(cur.address[1] if cur.address is not None else None)
+        elif cur.type != 'NUMBER' and cur.type != 'BOOL':
+            pending.append(None)
+            if cur.type in ('IF_EXP', 'AND', 'OR'):
+                pending.extend(reversed(cur.children[1:]))
+                pending.append(None)
+                pending.append(cur.children[0])
+            else:
+                pending.extend(reversed(cur.children))
+    first = events.index(None) if None in events else len(events)
+    return ([event for event in events[:first] if event in delayed] == delayed
+            and not any(event in delayed for event in events[first:]))
+
+
+def copy_body(body: Node, args):
+    # 複製函式本體，參數換成引數：沒有子節點的引數每次複製一份，其他引數只會出現一次，直接使用原本的節點。
+    # 回傳複製的根節點與先序排列的新節點（不含代入的引數）
+    root = []
+    copied = []
+    pending = [(body, root)]
+    while pending:
+        src, siblings = pending.pop()
+        if src.type == 'VARIABLE' and src.address is not None:
+            src = args[src.address[1]]
+            if src.children:
+                siblings.append(src)
+                continue
+        node = Node(src.type, value=src.value)
+        node.address = src.address
+        siblings.append(node)
+        copied.append(node)
+        for child in reversed(src.children):
+            pending.append((child, node.children))
+    return root[0], copied
+
+
+def join_types(a, b):
+    # 型別的聯集：None 表示還沒有任何值，object 表示 int、bool 以外或無法確定的值
+    if a is None or a is b:
+        return b
+    if b is None:
+        return a
+    return object
+
+
+def infer_types(program: Node, strict=False):
+    """
+    整個程式的型別推導。值的型別只分 int、bool 與其他；函式參數的型別是所有呼叫處引數型別的聯集，
+    全域函式的回傳型別是所有同名定義的本體型別的聯集，反覆計算直到不再改變。
+    推導完把每個節點一定是 int 或 bool 的值的型別記在 value_type，執行時的型別檢查一定通過的節點設定 proven。
+    program 必須是已經 resolve() 的完整程式，之後不會再有其他定義或呼叫；strict 與 Interpreter 的 strict 相同。
+    回傳執行到就一定會發生型別錯誤的節點，每項是 (第幾個敘述, 說明)。
+    """
+    # 先序走訪，記錄每個節點所在的函式（由外到內）以及是否在最內層函式的本體中（而不是函式內的 define）
+    order = []
+    pending = [(stmt, (), False, number) for number, stmt in reversed(list(enumerate(program.children, 1)))]
+    while pending:
+        node, scopes, in_body, number = item = pending.pop()
+        order.append(item)
+        if node.type == 'FUN_EXP':
+            scopes = scopes + (node,)
+            pending.append((node.children[-1], scopes, True, number))
+            pending.extend((define, scopes, False, number) for define in reversed(node.children[:-1]))
+        else:
+            pending.extend((child, scopes, in_body, number) for child in reversed(node.children))
+    functions = defaultdict(list)
+    for stmt in program.children:
+        if stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP':
+            functions[stmt.value].append(stmt.children[0])
+    types = {}
+    params = {}
+    results = {}
+    variables = {}
+    # 函式內 define 的變數，以 DEF 節點的 id 記錄
+    slots = {}
+    changed = True
+    while changed:
+        changed = False
+        # 子節點一定比父節點先計算
+        for node, scopes, in_body, _ in reversed(order):
+            node_type = node.type
+            if node_type == 'NUMBER':
+                value_type = int
+            elif node_type == 'BOOL':
+                value_type = bool
+            elif node_type in ('PLUS', 'MINUS', 'MUL', 'DIV', 'MOD'):
+                # 型別相同的 int 或 bool 做算術，結果都是 int；其他情況會拋出 TypeError
+                value_type = int
+            elif node_type in ('GREATER', 'LESS', 'EQUAL', 'NOT'):
+                value_type = bool
+            elif node_type in ('AND', 'OR', 'IF_EXP'):
+                # 結果是其中一個運算元或分支的值
+                value_type = None
+                for child in (node.children[1:] if node_type == 'IF_EXP' else node.children):
+                    value_type = join_types(value_type, types[child.id])
+            elif node_type == 'VARIABLE':
+                if node.address is None:
+                    value_type = variables.get(node.value)
+                else:
+                    depth, index = node.address
+                    fun_exp = scopes[-1 - depth]
+                    if index < len(fun_exp.value):
+                        value_type = params.setdefault(fun_exp.id, [None] * len(fun_exp.value))[index]
+                    else:
+                        define = fun_exp.children[index - len(fun_exp.value)]
+                        if define.children[0].type != 'FUN_EXP' and depth == 0 and in_body:
+                            # 函式內的 define 都執行完才會計算本體；define 之間或巢狀函式中可能讀到還沒定義的 None
+                            value_type = slots.get(define.id)
+                        else:
+                            value_type = object
+            elif node_type in ('FUN_CALL_DEFINED', 'FUN_CALL_ANONYMOUS'):
+                if node_type == 'FUN_CALL_ANONYMOUS':
+                    callees = node.children[:1]
+                    args = node.children[1:]
+                elif node.address is None:
+                    callees = functions.get(node.value, ())
+                    args = node.children
+                else:
+                    depth, index = node.address
+                    fun_exp = scopes[-1 - depth]
+                    callees = [fun_exp.children[index - len(fun_exp.value)].children[0]]
+                    args = node.children
+                value_type = None
+                for callee in callees:
+                    if len(args) < len(callee.value):
+                        # 引數不足，呼叫一定失敗
+                        continue
+                    arg_types = params.setdefault(callee.id, [None] * len(callee.value))
+                    for i in range(len(callee.value)):
+                        arg_type = join_types(arg_types[i], types[args[i].id])
+                        if arg_type is not arg_types[i]:
+                            arg_types[i] = arg_type
+                            changed = True
+                    value_type = join_types(value_type, results.get(callee.id))
+            elif node_type == 'FUN_EXP':
+                body_type = types[node.children[-1].id]
+                if body_type is not results.get(node.id):
+                    results[node.id] = body_type
+                    changed = True
+                value_type = object
+            else:
+                if node_type == 'DEF' and node.children[0].type != 'FUN_EXP':
+                    # 記錄所有定義的值的聯集
+                    table, key = (variables, node.value) if node.address is None else (slots, node.id)
+                    variable_type = join_types(table.get(key), types[node.children[0].id])
+                    if variable_type is not table.get(key):
+                        table[key] = variable_type
+                        changed = True
+                value_type = object
+            if node.id not in types or types[node.id] is not value_type:
+                types[node.id] = value_type
+                changed = True
+    for node, _, _, _ in order:
+        value_type = types[node.id]
+        node.value_type = value_type if value_type is int or value_type is bool else None
+    errors = []
+    for node, _, _, number in order:
+        node_type = node.type
+        operand_types = [child.value_type for child in node.children]
+        if node_type in CONSTANT_OPERATORS and node_type != 'NOT':
+            known = set(operand_types) - {None}
+            node.proven = len(known) == 1 and None not in operand_types
+            # 短路的 and/or 可能在型別不同的運算元之前就停止
+            if len(known) > 1 and (strict or node_type not in ('AND', 'OR')):
+                errors.append((number, f'{node_type} operands are int and bool'))
+            continue
+        if node_type == 'NOT' or node_type == 'PRINT_BOOL':
+            expected = bool
+        elif node_type == 'PRINT_NUM':
+            expected = int
+        elif node_type == 'IF_EXP':
+            expected = bool
+        else:
+            continue
+        node.proven = operand_types[0] is expected
+        if operand_types[0] is not None and operand_types[0] is not expected:
+            errors.append((number, f'{node_type} expects {expected.__name__}, got {operand_types[0].__name__}'))
+    return errors
+
+
+class MiniLispSyntaxError(Exception):
     pass
 
 
-def p_error(p):
-    global IS_VALID_SYNTAX
-    IS_VALID_SYNTAX = False
-    if IS_DEBUG:
-        print(f'Syntax error at {p.value!r}')
+class MiniLispArityError(IndexError):
+    """呼叫函式的引數比參數少；多出來的引數會被忽略"""
 
 
-parser = yacc()
-ast = parser.parse(data)
-if IS_VALID_SYNTAX and IS_DEBUG:
-    print("AST:")
-    print(ast)
-    print('---' * 10)
+def arity_error(param_cnt, arg_cnt):
+    # 每個後端在引數不足時都呼叫這裡，拋出相同的錯誤
+    raise MiniLispArityError(f'expected {param_cnt} arguments, got {arg_cnt}')
 
 
-def bfs(root: Node):
+def p_error(p):
+    # 遇到第一個語法錯誤就停止分析，交給 Interpreter 處理
+    if p:
+        raise MiniLispSyntaxError(f'Syntax error at {p.value!r}')
+    raise MiniLispSyntaxError('Syntax error at end of input')
+
+
+def bfs(root: Node, file=None):
     q = deque([root])
     while q:
         for _ in range(len(q)):
             node = q.popleft()
-            print(f'{node.type}:{node.value}', end=' ')
+            print(f'{node.type}:{node.value}', end=' ', file=file)
             for child in node.children:
                 q.append(child)
-        print()
-
-
-if IS_VALID_SYNTAX and IS_DEBUG:
-    print("AST BFS:")
-    bfs(ast)
-    print('---' * 10)
+        print(file=file)
 
 
 # --- Interpreter ---
 
 class Function:
-    def __init__(self, name, parm_list=[], arg_list=[], parm_dict={}, fun_exp=None):
+    """函式值，建立之後不會再改變；每次呼叫的引數放在另外配置的 Frame"""
+    __slots__ = ('name', 'params', 'fun_exp', 'parent', 'body')
+
+    def __init__(self, name, params, fun_exp=None, parent=None, body=None):
         self.name = name
-        self.parm_list = parm_list
-        self.arg_list = arg_list
-        self.parm_dict = parm_dict
+        self.params = params
         self.fun_exp = fun_exp
-        self.is_anonymous = self.name == '_'
-        self.caller = None
-
-    def reset_parameters(self):
-        self.parm_list.clear()
-        self.arg_list.clear()
-        self.parm_dict.clear()
-
-
-opr_stack = []
-# TODO: 應付遞迴或是嵌套函式的情況
-fun_stack: list[Function] = []
-variable_dict = defaultdict()
-function_dict = defaultdict()
-# NORMAL: 普通變數
-# FUNCTION_ANONYMOUS: 匿名函式取得參數
-# FUNCTION_DEFINED: 函式取得參數
-# VARIABLE_STATUS = "NORMAL"
-status_stack = []
-# 用來記錄函式的參數與引數的對應，加速遞迴函式的執行
-fun_param_memo = defaultdict()
-
-
-def travel_ast(cur: Node):
-    # global VARIABLE_STATUS
-    if cur.type == 'STMTS':
-        travel_ast(cur.children[0])
-        travel_ast(cur.children[1])
-    elif cur.type == 'PLUS':
-        opr_stack.append('+')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 + exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'MINUS':
-        opr_stack.append('-')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 - exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'MUL':
-        opr_stack.append('*')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 * exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'DIV':
-        opr_stack.append('/')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 // exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'MOD':
-        opr_stack.append('%')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 % exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'GREATER':
-        opr_stack.append('>')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 > exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'LESS':
-        opr_stack.append('<')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 < exp2
-        opr_stack.pop()
-        return res
-    elif cur.type == 'EQUAL':
-        opr_stack.append('=')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 == exp2
-        opr_stack.pop()
+        # 定義這個函式的外層 Frame（tree）或 env（其他後端），全域函式為 None
+        self.parent = parent
+        # closure、bytecode 或 python 後端編譯好的函式本體
+        self.body = body
+
+    @property
+    def is_anonymous(self):
+        return self.name == '_'
+
+
+class Frame:
+    """一次函式呼叫：slots 依序是參數與函式內 define 的值，parent 是定義函式的外層 Frame"""
+    __slots__ = ('function', 'slots', 'parent')
+
+    def __init__(self, function, slots, parent):
+        self.function = function
+        self.slots = slots
+        self.parent = parent
+
+    def __repr__(self):
+        return f'<Frame {self.function.name} {self.slots!r}>'
+
+
+class TailCall:
+    """尾端位置的呼叫：closure 與 python 後端的函式本體回傳它，由呼叫者的迴圈接著呼叫 function"""
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+
+def makes_calls(fun_exp: Node):
+    # 函式（包含函式內的 define）是否呼叫其他函式
+    return any(node.type == 'FUN_CALL_DEFINED' or node.type == 'FUN_CALL_ANONYMOUS' for node in subtree(fun_exp))
+
+
+# Memo.lookup() 找不到結果時回傳的值，函式的結果可能是 None
+NOT_CACHED = object()
+
+
+class Memo:
+    """
+    全域函式呼叫結果的 LRU 快取，所有後端共用。key 是 (函式名稱, 引數, 引數的型別)，
+    因為 True == 1，只比較引數會讓 bool 與 int 的呼叫共用結果。最多保留 size 筆，超過時丟掉最久沒用到的。
+    只快取 define() 決定的函式：include 中的名字一定快取，exclude 中的名字一定不快取，
+    其他函式只有在本體會呼叫函式時才快取；沒有呼叫的函式執行的時間不超過本體的大小，建立 key 不一定比較便宜。
+    快取的結果可能用到任何全域函式或變數，所以重新定義已經存在的全域名字時清空整個快取。
+    """
+
+    def __init__(self, size=MEMO_SIZE, include=(), exclude=()):
+        self.size = size
+        self.include = frozenset(include)
+        self.exclude = frozenset(exclude)
+        self.entries = OrderedDict()
+        # 目前會快取的函式名稱
+        self.functions = set()
+        # 已經定義過的全域函式與變數名稱
+        self.names = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def define(self, name, calls):
+        # 定義全域函式 name，calls 表示本體是否呼叫函式
+        self.assign(name)
+        self.functions.discard(name)
+        if self.size > 0 and name not in self.exclude and (calls or name in self.include):
+            self.functions.add(name)
+
+    def assign(self, name):
+        # 定義全域名字 name；重新定義時，快取的結果可能用到舊的定義，全部作廢
+        if name in self.names:
+            if self.entries:
+                self.entries.clear()
+                self.invalidations += 1
+        else:
+            self.names.add(name)
+
+    def lookup(self, name, args):
+        # 回傳 (key, 快取的結果)；不快取 name 時 key 是 None，沒有結果時是 NOT_CACHED
+        if name not in self.functions:
+            return None, NOT_CACHED
+        key = (name, tuple(args), tuple(map(type, args)))
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return key, entries[key]
+        self.misses += 1
+        return key, NOT_CACHED
+
+    def store(self, key, result):
+        entries = self.entries
+        entries[key] = result
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'entries': len(self.entries), 'size': self.size}
+
+
+class PhaseTimer:
+    # 累計各階段的牆鐘時間與 CPU 時間（秒）
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name, wall, cpu):
+        total = self.phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+        total['wall'] += wall
+        total['cpu'] += cpu
+
+
+class CountingLexer:
+    # 包裝 lexer，計算語法分析器取走的 token 數量
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.count = 0
+
+    def input(self, s):
+        self.lexer.input(s)
+
+    def token(self):
+        tok = self.lexer.token()
+        if tok:
+            self.count += 1
+        return tok
+
+
+def peak_rss_kb():
+    # Windows 沒有 resource 模組，回傳 None；ru_maxrss 在 Linux 上以 KB 為單位，在 macOS 上以 byte 為單位
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak // 1024
+    return peak
+
+
+class Interpreter:
+    """
+    Mini-LISP 直譯器。詞法分析器與語法分析器只在建構時產生一次，
+    之後可以用 run()/eval() 執行任意多個程式，每個 Interpreter 的狀態互相獨立。
+    """
+
+    def __init__(self, debug=False, out=None, timing=False, scanner=False, streaming=False, backend=BACKEND,
+                 dump_python=None, strict=False, fold=True, inline=INLINE_THRESHOLD, inline_report=None,
+                 infer=True, type_report=None, memo_size=MEMO_SIZE, memoize=(), no_memoize=()):
+        self.debug = debug
+        # strict 開啟時 and/or 計算所有運算元，否則短路
+        self.strict = strict
+        # fold 開啟時，分析完的 AST 先經過 fold_constants() 再執行
+        self.fold = fold
+        # 完整的程式先經過 inline_functions()，展開本體不超過 inline 個節點的函式，0 表示不展開；
+        # 展開的呼叫處記錄在 inlined，inline_report（檔案物件）不為 None 時另外逐行寫出
+        self.inline = inline
+        self.inline_report = inline_report
+        # infer 開啟時完整的程式再經過 infer_types()，省略一定通過的型別檢查；
+        # 執行前就能確定的型別錯誤記錄在 type_errors，type_report（檔案物件）不為 None 時另外逐行寫出
+        self.infer = infer
+        self.type_report = type_report
+        # 全域函式呼叫結果的快取設定，見 Memo
+        self.memo_size = memo_size
+        self.memoize = memoize
+        self.no_memoize = no_memoize
+        if backend not in BACKENDS:
+            raise ValueError(f'unknown backend {backend!r}, expected one of {BACKENDS}')
+        # backend 決定執行敘述的方式，見 evaluate()
+        self.backend = backend
+        # python 後端產生的原始碼寫到 dump_python（檔案物件），None 時不輸出
+        self.dump_python = dump_python
+        # streaming 開啟時（除錯模式除外），run() 每讀完一個最上層的敘述就執行並輸出，
+        # 執行完就釋放該敘述的 AST（被 function_dict 引用的函式本體除外），
+        # 因此語法錯誤之前的敘述會先被執行
+        self.streaming = streaming and not debug
+        # out 為 None 時輸出到 sys.stdout
+        self.out = out
+        # timing 開啟時，run() 結束後把各階段耗時的 JSON 報告寫到 stderr
+        self.timing = timing
+        self.timer = None
+        self.last_report = None
+        build_timer = PhaseTimer()
+        module = sys.modules[__name__]
+        with build_timer.phase('lex'):
+            # scanner 為 True 時使用手寫的 Scanner，不需要建構 ply 的 lexer
+            if scanner:
+                self.lexer = Scanner()
+            else:
+                self.lexer = lex(module=module, lextab=LEXER_TABLE_CACHE)
+        with build_timer.phase('yacc'):
+            self.parser = yacc(module=module, tabfile=PARSER_TABLE_CACHE)
+        self.build_phases = build_timer.phases
+        # 節點 opcode 對應的處理方法
+        self.handlers = [getattr(self, 'eval_' + node_type.lower()) for node_type in NODE_TYPES]
+        self.engine = None
+        self.reset()
+
+    def reset(self):
+        """清除所有變數、函式與執行期狀態"""
+        # 執行中的函式呼叫，頂端是目前的 Frame
+        self.fun_stack: list[Frame] = []
+        self.variable_dict = defaultdict()
+        self.function_dict = defaultdict()
+        # 記錄全域函式的引數與結果，加速遞迴函式的執行
+        self.memo = Memo(self.memo_size, self.memoize, self.no_memoize)
+        self.inlined = []
+        # run() 展開過的函式名稱 → 直接或間接展開了它的全域函式 DEF；originals 是這些 DEF 展開前的複本
+        self.inlined_into = defaultdict(set)
+        self.originals = {}
+        # 每個全域函式名稱目前綁定的 DEF
+        self.bound = {}
+        self.type_errors = []
+        # tree 與 stackless 後端實際執行的型別檢查次數
+        self.type_checks = 0
+        # 執行過針對整個程式的型別推導，目前綁定的函式只適用於那個程式，見 drop_proofs()
+        self.whole_program = False
+        # 其他後端綁定上面的狀態，所以每次 reset 都重新建立
+        if self.backend == 'stackless':
+            self.engine = StacklessEvaluator(self)
+        elif self.backend == 'closure':
+            self.engine = ClosureCompiler(self)
+        elif self.backend == 'bytecode':
+            self.engine = VirtualMachine(self)
+        elif self.backend == 'python':
+            self.engine = PythonTranspiler(self, dump=self.dump_python)
+
+    def tokenize(self, source) -> TokenBuffer:
+        """把整個 source 掃描進 TokenBuffer，之後可以重複交給 parse() 而不必重新掃描"""
+        return TokenBuffer(source, self.lexer)
+
+    def parse(self, source) -> Node:
+        """回傳 source（字串或 TokenBuffer）的 AST，語法錯誤時拋出 MiniLispSyntaxError"""
+        if isinstance(source, TokenBuffer):
+            return self.optimize(self.parser.parse(lexer=BufferLexer(source)))
+        return self.optimize(self.parser.parse(source, lexer=self.lexer))
+
+    def optimize(self, ast: Node, whole_program=False) -> Node:
+        """
+        分析與執行之間的最佳化：函式展開、常數摺疊與型別推導。
+        只有 whole_program 為 True（ast 是 run() 的完整程式）時才展開函式與推導型別，
+        eval() 與串流模式之後還可能重新定義或以其他型別呼叫函式，展開的本體與推導的型別會過時。
+        debug 模式不做最佳化，印出的 AST 就是語法分析的結果，也就是實際執行的 AST。
+        """
+        if self.debug:
+            self.drop_proofs()
+            return ast
+        self.whole_program = whole_program and bool(self.infer)
+        if whole_program and self.inline:
+            self.inlined = inline_functions(ast, self.inline, self.originals)
+            self.track_inlined(ast)
+            if self.inline_report is not None:
+                for name, caller, number in self.inlined:
+                    into = f' into {caller}' if caller is not None else ''
+                    print(f'inline {name}{into} at statement {number}', file=self.inline_report)
+        if self.fold:
+            fold_constants(ast, self.strict)
+        if whole_program and self.infer:
+            self.type_errors = infer_types(ast, self.strict)
+            if self.type_report is not None:
+                for number, message in self.type_errors:
+                    print(f'type error at statement {number}: {message}', file=self.type_report)
+        return ast
+
+    def track_inlined(self, ast: Node):
+        # 記錄每個被展開的函式展開到哪些全域函式裡；展開的本體中可能已經含有其他函式展開的本體，所以要遞移
+        functions = {stmt.value: stmt for stmt in ast.children
+                     if stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP'}
+        direct = defaultdict(set)
+        for name, caller, number in self.inlined:
+            if caller is not None:
+                direct[ast.children[number - 1]].add(name)
+        for caller, names in direct.items():
+            pending = list(names)
+            seen = set()
+            while pending:
+                name = pending.pop()
+                if name not in seen:
+                    seen.add(name)
+                    self.inlined_into[name].add(caller)
+                    pending.extend(direct.get(functions[name], ()))
+
+    def redefined(self, stmt: Node):
+        # eval() 重新定義全域函式：run() 中展開過舊定義、目前仍然綁定的全域函式換回展開前的定義
+        self.bound[stmt.value] = stmt
+        for caller in self.inlined_into.pop(stmt.value, ()):
+            if self.bound.get(caller.value) is caller:
+                original = self.originals[caller]
+                self.bound[caller.value] = original
+                self.evaluate(original)
+
+    def drop_proofs(self):
+        # run() 推導的型別只適用於那個程式，eval() 可能以其他型別呼叫函式或重新定義變數；
+        # 與 Memo 相同，不追蹤個別的相依關係，整批作廢：清除目前綁定的全域函式的型別並重新定義
+        self.whole_program = False
+        for stmt in list(self.bound.values()):
+            for node in subtree(stmt):
+                node.value_type = None
+                node.proven = False
+            self.evaluate(stmt)
+
+    def eval(self, source):
+        """
+        在目前的環境中執行 source，保留先前定義的變數與函式，回傳最後一個敘述的值。
+        語法錯誤拋出 MiniLispSyntaxError，型別錯誤拋出 TypeError，引數不足拋出 MiniLispArityError。
+        run() 展開過的函式被重新定義時，展開了它的函式換回展開前的定義，見 redefined()；
+        run() 的型別推導只適用於那個程式，第一次 eval() 前作廢，見 drop_proofs()。
+        """
+        if self.whole_program:
+            self.drop_proofs()
+        ast = self.parse(source)
+        result = None
+        try:
+            for stmt in ast.children:
+                result = self.evaluate(stmt)
+                if stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP':
+                    self.redefined(stmt)
+        except Exception:
+            # 執行中斷時清掉殘留的堆疊，已定義的變數與函式保留
+            self.fun_stack.clear()
+            raise
+        return result
+
+    def run(self, source):
+        """以全新的狀態執行一個完整的程式，行為與直接執行 main.py 相同"""
+        self.reset()
+        if self.debug:
+            # 除錯模式只掃描一次，印出 token 與語法分析共用同一個 TokenBuffer
+            buffer = self.tokenize(source)
+            self.print_tokens(buffer)
+            self.run_tokens(None, BufferLexer(buffer))
+        else:
+            self.run_tokens(source, self.lexer)
+
+    def run_file(self, path, chunk_size=CHUNK_SIZE):
+        """
+        與 run() 相同，但原始碼以 chunk_size 為單位分段讀取與掃描，整個檔案不必同時放在記憶體中。
+        一律使用 ChunkScanner；除錯模式需要完整的原始碼，所以改為整個讀入。
+        """
+        if self.debug:
+            with open(path, "r") as f:
+                return self.run(f.read())
+        self.reset()
+        with open(path, "r") as f:
+            self.run_tokens(None, ChunkScanner(f, chunk_size))
+
+    def run_tokens(self, source, lexer):
+        if self.timing:
+            self.timer = PhaseTimer()
+            lexer = CountingLexer(lexer)
+            node_counter = Node.node_counter
+        ast_nodes = None
+        try:
+            if self.streaming:
+                if source is not None:
+                    lexer.input(source)
+                self.stream(lexer)
+                return
+            try:
+                with self.phase('parse'):
+                    ast = self.optimize(self.parser.parse(source, lexer=lexer), whole_program=True)
+            except MiniLispSyntaxError as e:
+                if self.debug:
+                    print(e, file=self.out)
+                self.emit("syntax error")
+                return
+            if self.timing:
+                ast_nodes = Node.node_counter - node_counter
+            self.execute(ast)
+        finally:
+            if self.timing:
+                if self.streaming:
+                    ast_nodes = Node.node_counter - node_counter
+                self.report(lexer.count, ast_nodes)
+                self.timer = None
+
+    def stream(self, lexer):
+        forms = top_level_forms(lexer)
+        count = 0
+        try:
+            while True:
+                with self.phase('parse'):
+                    form = next(forms, None)
+                    if form is None:
+                        break
+                    program = self.optimize(self.parser.parse(lexer=FormLexer(form)))
+                with self.phase('evaluate'):
+                    for stmt in program.children:
+                        self.evaluate(stmt)
+                count += 1
+            if count == 0:
+                # 空的程式，與一次分析整個程式時相同，視為語法錯誤
+                raise MiniLispSyntaxError('Syntax error at end of input')
+        except MiniLispSyntaxError:
+            self.emit("syntax error")
+        except TypeError:
+            self.emit("Type error!")
+
+    def execute(self, ast):
+        if self.debug:
+            print("Accepted", file=self.out)
+            print("AST:", file=self.out)
+            print(ast, file=self.out)
+            print('---' * 10, file=self.out)
+            print("AST BFS:", file=self.out)
+            bfs(ast, file=self.out)
+            print('---' * 10, file=self.out)
+            if self.backend == 'bytecode':
+                print("Bytecode:", file=self.out)
+                for stmt in ast.children:
+                    disassemble(self.engine.compiler.compile(stmt), file=self.out)
+                print('---' * 10, file=self.out)
+            elif self.backend == 'python':
+                print("Python:", file=self.out)
+                for stmt in ast.children:
+                    print(self.engine.transpile(stmt), file=self.out)
+                print('---' * 10, file=self.out)
+            print("Result:", file=self.out)
+        try:
+            with self.phase('evaluate'):
+                # 有函式展開或型別推導時記錄每個全域函式名稱目前綁定的 DEF，供 eval() 重新定義或作廢型別時使用
+                track = bool(self.inlined_into) or self.whole_program
+                for stmt in ast.children:
+                    self.evaluate(stmt)
+                    if track and stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP':
+                        self.bound[stmt.value] = stmt
+        except TypeError:
+            self.emit("Type error!")
+        if self.debug:
+            print('---' * 10, file=self.out)
+            print("Variable Dictionary:", file=self.out)
+            print(self.variable_dict, file=self.out)
+            print("Function Dictionary:", file=self.out)
+            print(self.function_dict, file=self.out)
+            print("Function Stack:", file=self.out)
+            print(self.fun_stack, file=self.out)
+            plot_tree(ast)
+
+    def phase(self, name):
+        if self.timer is None:
+            return nullcontext()
+        return self.timer.phase(name)
+
+    def emit(self, text):
+        # 程式的輸出都經過這裡，計時模式下另外記錄輸出花費的時間
+        # 串流模式立即 flush，讓輸出不必等到程式結束
+        if self.timer is None:
+            print(text, file=self.out, flush=self.streaming)
+        else:
+            with self.timer.phase('print'):
+                print(text, file=self.out, flush=self.streaming)
+
+    def report(self, token_count, ast_nodes):
+        phases = dict(self.build_phases)
+        phases.update(self.timer.phases)
+        if 'evaluate' in phases and 'print' in phases:
+            # evaluate 的時間包含輸出，扣掉以免重複計算
+            evaluate = phases['evaluate']
+            phases['evaluate'] = {key: evaluate[key] - phases['print'][key] for key in evaluate}
+        self.last_report = {
+            'phases': phases,
+            'tokens': token_count,
+            'ast_nodes': ast_nodes,
+            'peak_rss_kb': peak_rss_kb(),
+            'type_checks': self.type_checks,
+            'memo': self.memo.stats(),
+        }
+        print(json.dumps(self.last_report), file=sys.stderr)
+
+    def print_tokens(self, buffer: TokenBuffer):
+        print("Tokens:", file=self.out)
+        for tok in buffer:
+            print(tok.type, tok.value, file=self.out)
+        print('---' * 10, file=self.out)
+
+    def evaluate(self, stmt: Node):
+        """以選定的後端執行一個最上層的敘述，回傳它的值"""
+        if self.engine is None:
+            return self.travel_ast(stmt)
+        return self.engine.evaluate(stmt)
+
+    def travel_ast(self, cur: Node):
+        # 以節點的 opcode 查表呼叫對應的 eval_* 方法；
+        # eval_* 方法計算子節點時直接查表，不經過這裡，巢狀的深度每層只占一個 Python 堆疊
+        return self.handlers[cur.op](cur)
+
+    def check_operands(self, cur: Node, values):
+        # 所有運算元的型別必須相同；infer_types() 證明過的節點不必檢查
+        if cur.proven:
+            return
+        self.type_checks += 1
+        value_type = type(values[0])
+        for value in values:
+            if type(value) is not value_type:
+                raise TypeError
+
+    def eval_program(self, cur: Node):
+        for stmt in cur.children:
+            self.travel_ast(stmt)
+
+    def eval_plus(self, cur: Node):
+        handlers = self.handlers
+        values = []
+        for child in cur.children:
+            values.append(handlers[child.op](child))
+        self.check_operands(cur, values)
+        res = 0
+        for value in values:
+            res += value
         return res
-    elif cur.type == 'AND':
-        opr_stack.append('and')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 and exp2
-        opr_stack.pop()
+
+    def eval_minus(self, cur: Node):
+        child1, child2 = cur.children
+        exp1 = self.handlers[child1.op](child1)
+        exp2 = self.handlers[child2.op](child2)
+        self.check_operands(cur, (exp1, exp2))
+        return exp1 - exp2
+
+    def eval_mul(self, cur: Node):
+        handlers = self.handlers
+        values = []
+        for child in cur.children:
+            values.append(handlers[child.op](child))
+        self.check_operands(cur, values)
+        res = 1
+        for value in values:
+            res *= value
         return res
-    elif cur.type == 'OR':
-        opr_stack.append('or')
-        exp1 = travel_ast(cur.children[0])
-        exp2 = travel_ast(cur.children[1])
-        if type(exp1) is not type(exp2):
-            raise TypeError
-        res = exp1 or exp2
-        opr_stack.pop()
+
+    def eval_div(self, cur: Node):
+        child1, child2 = cur.children
+        exp1 = self.handlers[child1.op](child1)
+        exp2 = self.handlers[child2.op](child2)
+        self.check_operands(cur, (exp1, exp2))
+        return exp1 // exp2
+
+    def eval_mod(self, cur: Node):
+        child1, child2 = cur.children
+        exp1 = self.handlers[child1.op](child1)
+        exp2 = self.handlers[child2.op](child2)
+        self.check_operands(cur, (exp1, exp2))
+        return exp1 % exp2
+
+    def eval_greater(self, cur: Node):
+        child1, child2 = cur.children
+        exp1 = self.handlers[child1.op](child1)
+        exp2 = self.handlers[child2.op](child2)
+        self.check_operands(cur, (exp1, exp2))
+        return exp1 > exp2
+
+    def eval_less(self, cur: Node):
+        child1, child2 = cur.children
+        exp1 = self.handlers[child1.op](child1)
+        exp2 = self.handlers[child2.op](child2)
+        self.check_operands(cur, (exp1, exp2))
+        return exp1 < exp2
+
+    def eval_equal(self, cur: Node):
+        handlers = self.handlers
+        values = []
+        for child in cur.children:
+            values.append(handlers[child.op](child))
+        self.check_operands(cur, values)
+        first = values[0]
+        for value in values:
+            if value != first:
+                return False
+        return True
+
+    def eval_and(self, cur: Node):
+        handlers = self.handlers
+        if self.strict:
+            values = []
+            for child in cur.children:
+                values.append(handlers[child.op](child))
+            self.check_operands(cur, values)
+            res = True
+            for value in values:
+                res = res and value
+            return res
+        # 依序計算運算元，遇到假值就停止；已計算的運算元型別必須與第一個相同
+        child = cur.children[0]
+        res = handlers[child.op](child)
+        value_type = type(res)
+        for child in cur.children[1:]:
+            if not res:
+                break
+            res = handlers[child.op](child)
+            self.check_type(cur, res, value_type)
         return res
-    elif cur.type == 'NOT':
-        opr_stack.append('not')
-        exp1 = travel_ast(cur.children[0])
-        if type(exp1) is not bool:
-            raise TypeError
-        res = not exp1
-        opr_stack.pop()
+
+    def eval_or(self, cur: Node):
+        handlers = self.handlers
+        if self.strict:
+            values = []
+            for child in cur.children:
+                values.append(handlers[child.op](child))
+            self.check_operands(cur, values)
+            res = False
+            for value in values:
+                res = res or value
+            return res
+        # 依序計算運算元，遇到真值就停止；已計算的運算元型別必須與第一個相同
+        child = cur.children[0]
+        res = handlers[child.op](child)
+        value_type = type(res)
+        for child in cur.children[1:]:
+            if res:
+                break
+            res = handlers[child.op](child)
+            self.check_type(cur, res, value_type)
         return res
-    elif cur.type == 'PRINT_NUM':
-        res = travel_ast(cur.children[0])
-        if type(res) is not int:
-            raise TypeError
-        print(res)
-    elif cur.type == 'PRINT_BOOL':
-        res = travel_ast(cur.children[0])
-        if type(res) is not bool:
-            raise TypeError
+
+    def check_type(self, cur: Node, value, value_type):
+        # 單一運算元的型別檢查，infer_types() 證明過的節點不必檢查
+        if not cur.proven:
+            self.type_checks += 1
+            if type(value) is not value_type:
+                raise TypeError
+
+    def eval_not(self, cur: Node):
+        child = cur.children[0]
+        exp1 = self.handlers[child.op](child)
+        self.check_type(cur, exp1, bool)
+        return not exp1
+
+    def eval_print_num(self, cur: Node):
+        child = cur.children[0]
+        res = self.handlers[child.op](child)
+        self.check_type(cur, res, int)
+        self.emit(res)
+
+    def eval_print_bool(self, cur: Node):
+        child = cur.children[0]
+        res = self.handlers[child.op](child)
+        self.check_type(cur, res, bool)
         if res:
-            print('#t')
+            self.emit('#t')
         else:
-            print('#f')
-    elif cur.type == 'NUMBER':
+            self.emit('#f')
+
+    def eval_number(self, cur: Node):
         return cur.value
-    elif cur.type == 'BOOL':
+
+    def eval_bool(self, cur: Node):
         return cur.value
-    elif cur.type == 'EXPS':
-        exp1 = travel_ast(cur.children[0])
-        exp2 = None
-        if opr_stack[-1] != 'not':
-            exp2 = travel_ast(cur.children[1])
-            if type(exp1) is not type(exp2):
-                raise TypeError
-        if opr_stack[-1] == '+':
-            return exp1 + exp2
-        elif opr_stack[-1] == '-':
-            return exp1 - exp2
-        elif opr_stack[-1] == '*':
-            return exp1 * exp2
-        elif opr_stack[-1] == '/':
-            return exp1 // exp2
-        elif opr_stack[-1] == '%':
-            return exp1 % exp2
-        elif opr_stack[-1] == '>':
-            return exp1 > exp2
-        elif opr_stack[-1] == '<':
-            return exp1 < exp2
-        elif opr_stack[-1] == '=':
-            return exp1 == exp2
-        elif opr_stack[-1] == 'and':
-            return exp1 and exp2
-        elif opr_stack[-1] == 'or':
-            return exp1 or exp2
-        elif opr_stack[-1] == 'not':
-            if type(exp1) is not bool:
-                raise TypeError
-            return not exp1
-    elif cur.type == 'IF_EXP':
+
+    def eval_if_exp(self, cur: Node):
         # ast tree: IF_EXP
-        #    TEST_EXP THAN_EXP ELSE_EXP
-        if travel_ast(cur.children[0]):
-            return travel_ast(cur.children[1])
+        #    test then else
+        test_exp, then_exp, else_exp = cur.children
+        test = self.handlers[test_exp.op](test_exp)
+        self.check_type(cur, test, bool)
+        if test:
+            return self.handlers[then_exp.op](then_exp)
         else:
-            return travel_ast(cur.children[2])
-    elif cur.type == 'TEST_EXP':
-        # ast tree: TEST_EXP->EXP
-        res = travel_ast(cur.children[0])
-        if type(res) is not bool:
-            raise TypeError
-        return res
-    elif cur.type == 'THAN_EXP':
-        # ast tree: THAN_EXP->EXP
-        return travel_ast(cur.children[0])
-    elif cur.type == 'ELSE_EXP':
-        # ast tree: ELSE_EXP->EXP
-        return travel_ast(cur.children[0])
-    elif cur.type == 'DEF':
-        # ast tree: DEF->VARIABLE->ID
-        # 直接從 DEF 找到 ID
-        if cur.children[0].type == 'VARIABLE':
-            # ast tree: DEF->VARIABLE->ID->EXP
-            # 變數定義
-            variable_dict[cur.children[0].children[0].value] = travel_ast(cur.children[1])
-        elif cur.children[0].type == 'FUN_NAME':
-            # ast tree: DEF->FUN_NAME->ID
+            return self.handlers[else_exp.op](else_exp)
+
+    def eval_def(self, cur: Node):
+        # ast tree: DEF(name)->EXP
+        exp = cur.children[0]
+        if exp.type == 'FUN_EXP':
             # 函式定義
-            # 由名字綁定一個Function物件，其中包含函式名稱、參數、引數、函式表達式(FUN_EXP)
-            new_fun = Function(cur.children[0].children[0].value, [], [], {}, cur.children[1])
-            function_dict[cur.children[0].children[0].value] = new_fun
-    elif cur.type == 'VARIABLE':
-        # ast tree: VARIABLE->ID
-        # 從 VARIABLE 找到 ID
-        # 這裡要注意，如果是函式的參數，就不要從 variable_dict 找，而是從 parm_dict 找
-        if not status_stack:
-            status = "NORMAL"
+            # 由名字綁定一個Function物件，其中包含函式名稱、參數、函式表達式(FUN_EXP)與外層 Frame
+            value = Function(cur.value, exp.value, exp, self.fun_stack[-1] if cur.address is not None else None)
         else:
-            status = status_stack[-1]
-        variable_name = cur.children[0].value
-        if status == "NORMAL":
-            return variable_dict[variable_name]
-        elif status == "FUNCTION_ANONYMOUS":
-            return fun_stack[-1].parm_dict[variable_name]
-        elif status == "FUNCTION_DEFINED":
-            param_cnt = len(fun_stack[-1].parm_list)
-            if param_cnt == 0:
-                # 如果是零個參數，就從 variable_dict 找
-                return variable_dict[variable_name]
-            elif param_cnt == 1:
-                if variable_name in fun_stack[-1].parm_dict:
-                    return fun_stack[-1].parm_dict[variable_name]
-                elif fun_stack[-1].caller and variable_name in fun_stack[-1].caller.parm_dict:
-                    return fun_stack[-1].caller.parm_dict[variable_name]
-                else:
-                    # 如果都沒找到，就從 variable_dict 找，最終選擇
-                    return variable_dict[cur.children[0].value]
+            # 變數定義
+            value = self.handlers[exp.op](exp)
+        if cur.address is None:
+            if exp.type == 'FUN_EXP':
+                self.function_dict[cur.value] = value
+                self.memo.define(cur.value, makes_calls(exp))
             else:
-                if fun_stack[-1].caller and variable_name in fun_stack[-1].caller.parm_dict:
-                    return fun_stack[-1].caller.parm_dict[variable_name]
-                elif variable_name in fun_stack[-1].parm_dict:
-                    return fun_stack[-1].parm_dict[variable_name]
-                else:
-                    # 如果都沒找到，就從 variable_dict 找，最終選擇
-                    return variable_dict[cur.children[0].value]
-    elif cur.type == 'FUN_CALL_ANONYMOUS':
-        # 匿名函式初始化，但這樣寫並沒有考慮嵌套函式的情況
-        VARIABLE_STATUS = "FUNCTION_ANONYMOUS"
-        status_stack.append(VARIABLE_STATUS)
+                self.variable_dict[cur.value] = value
+                self.memo.assign(cur.value)
+        else:
+            # 函式內的定義放在目前 Frame 的位置上
+            self.fun_stack[-1].slots[cur.address[1]] = value
+
+    def load(self, address):
+        # 由 resolve() 決定的 (depth, index) 直接取值
+        depth, index = address
+        frame = self.fun_stack[-1]
+        for _ in range(depth):
+            frame = frame.parent
+        return frame.slots[index]
+
+    def eval_variable(self, cur: Node):
+        if cur.address is None:
+            return self.variable_dict[cur.value]
+        return self.load(cur.address)
+
+    def eval_fun_call_anonymous(self, cur: Node):
+        # ast tree: FUN_CALL_ANONYMOUS->[FUN_EXP, 引數...]
+        handlers = self.handlers
+        args = []
+        for arg in cur.children[1:]:
+            args.append(handlers[arg.op](arg))
         fun_exp = cur.children[0]
-        fun_to_call = Function('_', [], [], {}, fun_exp)
-        fun_stack.append(fun_to_call)
-        # ast tree: FUN_CALL_ANONYMOUS->FUN_EXP
-        # 蒐集參數
-        travel_ast(fun_exp)
-        # ast tree: FUN_CALL_ANONYMOUS->PARAMS
-        # 蒐集引數
-        travel_ast(cur.children[1])
-        # Binding 參數與引數綁定
-        for i in range(len(fun_to_call.parm_list)):
-            fun_to_call.parm_dict[fun_to_call.parm_list[i]] = fun_to_call.arg_list[i]
-        # ast tree: FUN_CALL_ANONYMOUS->FUN_EXP->FUN_BODY
-        # 函式本體
-        fun_body = fun_to_call.fun_exp.children[1]
-        result = travel_ast(fun_body)
-        # VARIABLE_STATUS = "NORMAL"
-        fun_stack.pop()
-        status_stack.pop()
-        return result
-    elif cur.type == 'FUN_EXP':
-        # ast tree: FUN_EXP->FUN_IDs
-        # 蒐集參數
-        travel_ast(cur.children[0])
-    elif cur.type == 'FUN_IDs':
-        # ast tree: FUN_IDs->VARIABLES
-        # 蒐集參數
-        travel_ast(cur.children[0])
-    elif cur.type == 'FUN_BODY':
-        # ast tree: FUN_BODY->EXP
-        # 函式本體
-        return travel_ast(cur.children[0])
-    elif cur.type == 'PARAMS':
-        # 只有函式呼叫會出現的節點
-        if cur.children[0].type == 'NULL':
-            # ast tree: PARAMS->NULL
-            # 代表沒有引數
-            pass
-        elif cur.children[0].type == 'PARAM':
-            # ast tree: PARAMS->PARAM->EXP(could be FUN_CALL)
-            # 蒐集引數
-            fun_stack[-1].arg_list.append(travel_ast(cur.children[0].children[0]))
-        if cur.children[1].type == 'PARAMS':
-            # ast tree: PARAMS->PARAMS->PARAM->EXP
-            # 蒐集更多引數
-            travel_ast(cur.children[1])
-    elif cur.type == 'PARAM':
-        # 因為會直接從PARAMS->PARAM->EXP，所以這裡不會被執行到
-        pass
-    elif cur.type == 'VARIABLES':
-        # 只有函式呼叫會出現的節點
-        if cur.children[0].type == 'NULL':
-            # ast tree: VARIABLES->NULL
-            # 代表沒有參數
-            pass
-        elif cur.children[0].type == 'VARIABLE':
-            # ast tree: VARIABLES->VARIABLE->ID
-            # 蒐集參數
-            fun_stack[-1].parm_list.append(cur.children[0].children[0].value)
-        if cur.children[1].type == 'VARIABLES':
-            # ast tree: VARIABLES->VARIABLES->VARIABLE->ID
-            # 蒐集更多參數
-            travel_ast(cur.children[1])
-    elif cur.type == 'FUN_CALL_DEFINED':
-        # TODO: 應付遞迴或是嵌套函式的情況
-        VARIABLE_STATUS = "FUNCTION_DEFINED"
-        status_stack.append(VARIABLE_STATUS)
-        # ast tree: FUN_CALL_DEFINED->FUN_NAME->ID
-        fun_name = cur.children[0].children[0].value
+        # 匿名函式就寫在目前的函式裡，外層就是目前的 Frame
+        fun_to_call = Function('_', fun_exp.value, fun_exp, self.fun_stack[-1] if self.fun_stack else None)
+        return self.call_function(fun_to_call, args)
+
+    def eval_fun_call_defined(self, cur: Node):
+        # ast tree: FUN_CALL_DEFINED(name)->[引數...]
+        fun_name = cur.value
+        # 引數在呼叫者的 activation 中計算
+        handlers = self.handlers
+        args = []
+        for arg in cur.children:
+            args.append(handlers[arg.op](arg))
         # 找到對應的Function物件
-        if fun_stack and fun_name == fun_stack[-1].name:
-            # 是遞迴函式，但這樣判斷並不準確
-            fun_to_call = deepcopy(fun_stack[-1])
-            fun_to_call.parm_list.clear()
-            fun_to_call.arg_list.clear()
-            fun_to_call.caller = fun_stack[-1]
+        if cur.address is None:
+            fun = self.function_dict[fun_name]
         else:
-            fun_to_call = function_dict[fun_name]
-            fun_to_call.parm_list.clear()
-            fun_to_call.arg_list.clear()
-            if fun_stack:
-                fun_to_call.caller = fun_stack[-1]
+            fun = self.load(cur.address)
+        # 只有全域函式使用 memo，同名的巢狀函式可能屬於不同的外層
+        return self.call_function(fun, args, memo_key=fun_name if cur.address is None else None)
+
+    def eval_fun_exp(self, cur: Node):
+        pass
+
+    def call_function(self, fun_to_call: Function, args, memo_key=None):
+        # 尾端呼叫（函式本體，或作為函式本體的 if 的分支，直接是一個呼叫）不遞迴，
+        # 在這個迴圈中改為執行被呼叫的函式並沿用目前的 Frame，所以尾遞迴與互相尾遞迴只占用固定的堆疊。
+        # memo 只記錄最外層的呼叫，中間的尾端呼叫仍會查詢 memo
+        frame = None
+        outer_key = None
+        while True:
+            fun_exp = fun_to_call.fun_exp
+            param_cnt = len(fun_to_call.params)
+            if len(args) < param_cnt:
+                arity_error(param_cnt, len(args))
+            if memo_key is not None:
+                key, result = self.memo.lookup(memo_key, args)
+                if result is not NOT_CACHED:
+                    break
+                if frame is None:
+                    outer_key = key
+            # Binding 參數與引數綁定：Frame 依序放參數，接著是函式內 define 的位置
+            del args[param_cnt:]
+            args.extend([None] * (len(fun_exp.children) - 1))
+            if frame is None:
+                frame = Frame(fun_to_call, args, fun_to_call.parent)
+                self.fun_stack.append(frame)
+            elif fun_to_call.parent is frame:
+                # 被呼叫的函式定義在目前的 Frame 中，目前的 Frame 還會被用到，另外配置
+                frame = Frame(fun_to_call, args, fun_to_call.parent)
+                self.fun_stack[-1] = frame
             else:
-                fun_to_call.caller = None
-        fun_stack.append(fun_to_call)
-        fun_exp = fun_to_call.fun_exp
-        # ast tree: FUN_EXP->[FUN_IDs]
-        # 蒐集參數
-        travel_ast(fun_exp)
-        # ast tree: FUN_CALL_DEFINED->PARAMS
-        # 蒐集引數
-        travel_ast(cur.children[1])
-        # Binding 參數與引數綁定
-        for i in range(len(fun_to_call.parm_list)):
-            fun_to_call.parm_dict[fun_to_call.parm_list[i]] = fun_to_call.arg_list[i]
-        # ast tree: FUN_EXP->FUN_BODY
-        # 函式本體
-        fun_body = fun_to_call.fun_exp.children[1]
-        if (fun_name, tuple(fun_to_call.arg_list)) in fun_param_memo:
-            result = fun_param_memo[(fun_name, tuple(fun_to_call.arg_list))]
-        else:
-            result = travel_ast(fun_body)
-            fun_param_memo[(fun_name, tuple(fun_to_call.arg_list))] = result
-        # print(f'{fun_name}({fun_to_call.parm_dict})={result}')
-        # VARIABLE_STATUS = "NORMAL"
-        fun_stack.pop()
-        status_stack.pop()
+                frame.function = fun_to_call
+                frame.slots = args
+                frame.parent = fun_to_call.parent
+            # ast tree: FUN_EXP->[DEF..., 函式本體]
+            handlers = self.handlers
+            for define in fun_exp.children[:-1]:
+                handlers[define.op](define)
+            node = fun_exp.children[-1]
+            while node.type == 'IF_EXP':
+                test_exp = node.children[0]
+                test = handlers[test_exp.op](test_exp)
+                self.check_type(node, test, bool)
+                node = node.children[1] if test else node.children[2]
+            if node.type == 'FUN_CALL_DEFINED':
+                args = []
+                for arg in node.children:
+                    args.append(handlers[arg.op](arg))
+                if node.address is None:
+                    fun_to_call = self.function_dict[node.value]
+                    memo_key = node.value
+                else:
+                    fun_to_call = self.load(node.address)
+                    memo_key = None
+            elif node.type == 'FUN_CALL_ANONYMOUS':
+                args = []
+                for arg in node.children[1:]:
+                    args.append(handlers[arg.op](arg))
+                fun_to_call = Function('_', node.children[0].value, node.children[0], frame)
+                memo_key = None
+            else:
+                result = handlers[node.op](node)
+                break
+        if frame is not None:
+            self.fun_stack.pop()
+        if outer_key is not None:
+            self.memo.store(outer_key, result)
         return result
-    elif cur.type == 'FUN_NAME':
-        # 因為會直接從FUN_CALL_DEFINED->FUN_NAME->ID，所以這裡不會被執行到
-        pass
-    elif cur.type == 'NULL':
-        pass
 
 
-if IS_VALID_SYNTAX and IS_DEBUG:
-    print("Result:")
+# --- Stackless backend ---
+
+
+class StacklessEvaluator:
+    """
+    不使用 Python 的遞迴走訪 AST：待做的工作放在 todo，算出的值放在 values，兩者都是 heap 上的串列，
+    所以 Mini-LISP 的遞迴深度只受記憶體限制，不需要調整 sys.setrecursionlimit。
+    todo 的每一項是 (continuation, 參數)，continuation 是下面的 eval_*（計算一個節點）或其他方法（用子節點的值接著做）。
+    運算式在 values 留下一個值，PRINT_NUM、PRINT_BOOL 與 DEF 不留值。
+    函式呼叫使用 Interpreter 的 Frame 與 fun_stack；呼叫之後的工作就是 leave 時即為尾端呼叫，直接取代目前的 Frame。
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.evaluators = [getattr(self, 'eval_' + node_type.lower()) for node_type in NODE_TYPES]
+        self.todo = []
+        self.values = []
+
+    def evaluate(self, stmt: Node):
+        todo = self.todo
+        values = self.values
+        todo.clear()
+        values.clear()
+        todo.append((self.evaluators[stmt.op], stmt))
+        while todo:
+            continuation, arg = todo.pop()
+            continuation(arg)
+        return values.pop() if values else None
+
+    def schedule(self, continuation, node: Node, children):
+        # 先依序計算 children，再以 node 呼叫 continuation
+        todo = self.todo
+        evaluators = self.evaluators
+        todo.append((continuation, node))
+        for child in reversed(children):
+            todo.append((evaluators[child.op], child))
+
+    def operand_values(self, node: Node):
+        # 取出 node 所有運算元的值，所有運算元的型別必須相同
+        values = self.values
+        count = len(node.children)
+        operands = values[len(values) - count:]
+        del values[len(values) - count:]
+        if node.proven:
+            return operands
+        self.interpreter.type_checks += 1
+        value_type = type(operands[0])
+        for value in operands:
+            if type(value) is not value_type:
+                raise TypeError
+        return operands
+
+    def eval_program(self, node: Node):
+        for stmt in reversed(node.children):
+            self.todo.append((self.discard, len(self.values)))
+            self.todo.append((self.evaluators[stmt.op], stmt))
+
+    def discard(self, depth):
+        del self.values[depth:]
+
+    def eval_plus(self, node: Node):
+        self.schedule(self.apply_plus, node, node.children)
+
+    def apply_plus(self, node: Node):
+        res = 0
+        for value in self.operand_values(node):
+            res += value
+        self.values.append(res)
+
+    def eval_minus(self, node: Node):
+        self.schedule(self.apply_minus, node, node.children)
+
+    def apply_minus(self, node: Node):
+        exp1, exp2 = self.operand_values(node)
+        self.values.append(exp1 - exp2)
+
+    def eval_mul(self, node: Node):
+        self.schedule(self.apply_mul, node, node.children)
+
+    def apply_mul(self, node: Node):
+        res = 1
+        for value in self.operand_values(node):
+            res *= value
+        self.values.append(res)
+
+    def eval_div(self, node: Node):
+        self.schedule(self.apply_div, node, node.children)
+
+    def apply_div(self, node: Node):
+        exp1, exp2 = self.operand_values(node)
+        self.values.append(exp1 // exp2)
+
+    def eval_mod(self, node: Node):
+        self.schedule(self.apply_mod, node, node.children)
+
+    def apply_mod(self, node: Node):
+        exp1, exp2 = self.operand_values(node)
+        self.values.append(exp1 % exp2)
+
+    def eval_greater(self, node: Node):
+        self.schedule(self.apply_greater, node, node.children)
+
+    def apply_greater(self, node: Node):
+        exp1, exp2 = self.operand_values(node)
+        self.values.append(exp1 > exp2)
+
+    def eval_less(self, node: Node):
+        self.schedule(self.apply_less, node, node.children)
+
+    def apply_less(self, node: Node):
+        exp1, exp2 = self.operand_values(node)
+        self.values.append(exp1 < exp2)
+
+    def eval_equal(self, node: Node):
+        self.schedule(self.apply_equal, node, node.children)
+
+    def apply_equal(self, node: Node):
+        operands = self.operand_values(node)
+        first = operands[0]
+        res = True
+        for value in operands:
+            if value != first:
+                res = False
+                break
+        self.values.append(res)
+
+    def eval_and(self, node: Node):
+        if not self.interpreter.strict:
+            self.schedule(self.short_circuit, (node, 1), node.children[:1])
+            return
+        self.schedule(self.apply_and, node, node.children)
+
+    def apply_and(self, node: Node):
+        res = True
+        for value in self.operand_values(node):
+            res = res and value
+        self.values.append(res)
+
+    def eval_or(self, node: Node):
+        if not self.interpreter.strict:
+            self.schedule(self.short_circuit, (node, 1), node.children[:1])
+            return
+        self.schedule(self.apply_or, node, node.children)
+
+    def apply_or(self, node: Node):
+        res = False
+        for value in self.operand_values(node):
+            res = res or value
+        self.values.append(res)
+
+    def short_circuit(self, state):
+        # values 頂端是到目前為止的結果，index 是下一個運算元
+        node, index = state
+        values = self.values
+        if index > 1:
+            res = values.pop()
+            if not node.proven:
+                self.interpreter.type_checks += 1
+                if type(res) is not type(values[-1]):
+                    raise TypeError
+            values[-1] = res
+        res = values[-1]
+        if index == len(node.children) or bool(res) is not (node.type == 'AND'):
+            return
+        self.schedule(self.short_circuit, (node, index + 1), node.children[index:index + 1])
+
+    def check_type(self, node: Node, value, value_type):
+        # 與 Interpreter.check_type 相同
+        if not node.proven:
+            self.interpreter.type_checks += 1
+            if type(value) is not value_type:
+                raise TypeError
+
+    def eval_not(self, node: Node):
+        self.schedule(self.apply_not, node, node.children)
+
+    def apply_not(self, node: Node):
+        exp1 = self.values[-1]
+        self.check_type(node, exp1, bool)
+        self.values[-1] = not exp1
+
+    def eval_print_num(self, node: Node):
+        self.schedule(self.apply_print_num, node, node.children)
+
+    def apply_print_num(self, node: Node):
+        res = self.values.pop()
+        self.check_type(node, res, int)
+        self.interpreter.emit(res)
+
+    def eval_print_bool(self, node: Node):
+        self.schedule(self.apply_print_bool, node, node.children)
+
+    def apply_print_bool(self, node: Node):
+        res = self.values.pop()
+        self.check_type(node, res, bool)
+        if res:
+            self.interpreter.emit('#t')
+        else:
+            self.interpreter.emit('#f')
+
+    def eval_number(self, node: Node):
+        self.values.append(node.value)
+
+    def eval_bool(self, node: Node):
+        self.values.append(node.value)
+
+    def eval_if_exp(self, node: Node):
+        self.schedule(self.branch, node, node.children[:1])
+
+    def branch(self, node: Node):
+        test = self.values.pop()
+        self.check_type(node, test, bool)
+        child = node.children[1] if test else node.children[2]
+        self.todo.append((self.evaluators[child.op], child))
+
+    def eval_def(self, node: Node):
+        exp = node.children[0]
+        if exp.type == 'FUN_EXP':
+            self.store(node)
+        else:
+            self.schedule(self.store, node, node.children)
+
+    def store(self, node: Node):
+        # 全域的名字放進 dict，函式內的定義放在目前 Frame 的位置上
+        interpreter = self.interpreter
+        exp = node.children[0]
+        if exp.type == 'FUN_EXP':
+            parent = interpreter.fun_stack[-1] if node.address is not None else None
+            value = Function(node.value, exp.value, exp, parent)
+        else:
+            value = self.values.pop()
+        if node.address is None:
+            if exp.type == 'FUN_EXP':
+                interpreter.function_dict[node.value] = value
+                interpreter.memo.define(node.value, makes_calls(exp))
+            else:
+                interpreter.variable_dict[node.value] = value
+                interpreter.memo.assign(node.value)
+        else:
+            interpreter.fun_stack[-1].slots[node.address[1]] = value
+
+    def eval_variable(self, node: Node):
+        if node.address is None:
+            self.values.append(self.interpreter.variable_dict[node.value])
+        else:
+            self.values.append(self.interpreter.load(node.address))
+
+    def eval_fun_call_anonymous(self, node: Node):
+        self.schedule(self.call_anonymous, node, node.children[1:])
+
+    def call_anonymous(self, node: Node):
+        fun_stack = self.interpreter.fun_stack
+        fun_exp = node.children[0]
+        fun = Function('_', fun_exp.value, fun_exp, fun_stack[-1] if fun_stack else None)
+        self.enter(fun, self.arguments(len(node.children) - 1), None)
+
+    def eval_fun_call_defined(self, node: Node):
+        self.schedule(self.call_defined, node, node.children)
+
+    def call_defined(self, node: Node):
+        args = self.arguments(len(node.children))
+        if node.address is None:
+            self.enter(self.interpreter.function_dict[node.value], args, node.value)
+        else:
+            # 只有全域函式使用 memo
+            self.enter(self.interpreter.load(node.address), args, None)
+
+    def arguments(self, count):
+        values = self.values
+        args = values[len(values) - count:]
+        del values[len(values) - count:]
+        return args
+
+    def enter(self, fun: Function, args, memo_key):
+        # 檢查引數個數、查詢 memo、配置 Frame，再排入函式內的定義與函式本體
+        interpreter = self.interpreter
+        fun_exp = fun.fun_exp
+        param_cnt = len(fun.params)
+        if len(args) < param_cnt:
+            arity_error(param_cnt, len(args))
+        key = None
+        if memo_key is not None:
+            key, result = interpreter.memo.lookup(memo_key, args)
+            if result is not NOT_CACHED:
+                self.values.append(result)
+                return
+        del args[param_cnt:]
+        args.extend([None] * (len(fun_exp.children) - 1))
+        frame = Frame(fun, args, fun.parent)
+        todo = self.todo
+        if todo and todo[-1][0] == self.leave:
+            # 尾端呼叫：取代目前的 Frame，memo 只記錄最外層的呼叫
+            interpreter.fun_stack[-1] = frame
+        else:
+            interpreter.fun_stack.append(frame)
+            todo.append((self.leave, key))
+        # ast tree: FUN_EXP->[DEF..., 函式本體]，DEF 不留值，函式本體的值就是回傳值
+        evaluators = self.evaluators
+        for child in reversed(fun_exp.children):
+            todo.append((evaluators[child.op], child))
+
+    def leave(self, key):
+        self.interpreter.fun_stack.pop()
+        if key is not None:
+            self.interpreter.memo.store(key, self.values[-1])
+
+    def eval_fun_exp(self, node: Node):
+        self.values.append(None)
+
+
+# --- Closure backend ---
+
+
+class ClosureCompiler:
+    """
+    把 AST 走訪一次，編譯成巢狀的 Python closure，例如 PLUS 節點變成 lambda env: a(env) + b(env)。
+    執行時不再分派節點。
+    env 是 [外層 env, 參數..., 函式內的定義...] 的串列，最上層的 env 是 None；
+    變數依 resolve() 決定的 (depth, index) 直接取值，全域的名字才在執行時查 variable_dict。
+    編譯出的 closure 綁定 Interpreter 目前的 variable_dict 等狀態，reset() 之後要重新編譯。
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.compilers = {
+            'PROGRAM': self.compile_program,
+            'PLUS': self.compile_plus,
+            'MINUS': self.compile_binary,
+            'MUL': self.compile_mul,
+            'DIV': self.compile_binary,
+            'MOD': self.compile_binary,
+            'GREATER': self.compile_binary,
+            'LESS': self.compile_binary,
+            'EQUAL': self.compile_equal,
+            'AND': self.compile_and,
+            'OR': self.compile_or,
+            'NOT': self.compile_not,
+            'PRINT_NUM': self.compile_print_num,
+            'PRINT_BOOL': self.compile_print_bool,
+            'NUMBER': self.compile_constant,
+            'BOOL': self.compile_constant,
+            'IF_EXP': self.compile_if_exp,
+            'DEF': self.compile_def,
+            'VARIABLE': self.compile_variable,
+            'FUN_CALL_ANONYMOUS': self.compile_fun_call_anonymous,
+            'FUN_CALL_DEFINED': self.compile_fun_call_defined,
+            'FUN_EXP': self.compile_fun_exp,
+        }
+        # compile_tree() 暫存已經編譯好的子孫節點
+        self.compiled = {}
+
+    def evaluate(self, stmt: Node):
+        return self.compile_tree(stmt)(None)
+
+    def compile_tree(self, root: Node):
+        # 先序走訪的反向是子孫先於祖先，依這個順序編譯並暫存，編譯每個節點時子節點都已經編譯好，
+        # 編譯不隨巢狀深度遞迴；執行時產生的 closure 每層巢狀只占一個 Python 堆疊
+        nodes = subtree(root)
+        tail = set()
+        for node in nodes:
+            if node.type == 'FUN_EXP':
+                tail.add(node.children[-1])
+            elif node.type == 'IF_EXP' and node in tail:
+                tail.update(node.children[1:])
+        try:
+            for node in reversed(nodes):
+                self.compiled[node] = self.compile_tail(node) if node in tail else self.compile(node)
+            return self.compiled[root]
+        finally:
+            self.compiled.clear()
+
+    def compile(self, node: Node):
+        compiled = self.compiled.get(node)
+        if compiled is not None:
+            return compiled
+        return self.compilers[node.type](node)
+
+    def compile_tail(self, node: Node):
+        # 函式本體與其中 if 的分支是尾端位置，這裡的呼叫回傳 TailCall，由 call() 的迴圈執行
+        compiled = self.compiled.get(node)
+        if compiled is not None:
+            return compiled
+        if node.type == 'IF_EXP':
+            return self.compile_if_exp(node, tail=True)
+        elif node.type == 'FUN_CALL_ANONYMOUS':
+            return self.compile_fun_call_anonymous(node, tail=True)
+        elif node.type == 'FUN_CALL_DEFINED':
+            return self.compile_fun_call_defined(node, tail=True)
+        return self.compile(node)
+
+    def compile_children(self, node: Node):
+        return [self.compile(child) for child in node.children]
+
+    def compile_program(self, node: Node):
+        stmts = self.compile_children(node)
+
+        def program(env):
+            for stmt in stmts:
+                stmt(env)
+        return program
+
+    @staticmethod
+    def check_operands(values):
+        # 所有運算元都計算完之後才檢查型別相同，與 Interpreter.check_operands 一致；
+        # 運算元在呼叫端的 closure 中計算，這裡不在巢狀的路徑上，不增加每層占用的堆疊
+        value_type = type(values[0])
+        for value in values:
+            if type(value) is not value_type:
+                raise TypeError
+
+    def compile_binary(self, node: Node):
+        a, b = self.compile_children(node)
+        if node.proven:
+            # infer_types() 證明兩個運算元的型別相同，不必檢查
+            match node.type:
+                case 'MINUS':
+                    return lambda env: a(env) - b(env)
+                case 'DIV':
+                    return lambda env: a(env) // b(env)
+                case 'MOD':
+                    return lambda env: a(env) % b(env)
+                case 'GREATER':
+                    return lambda env: a(env) > b(env)
+                case 'LESS':
+                    return lambda env: a(env) < b(env)
+        match node.type:
+            case 'MINUS':
+                def binary(env):
+                    exp1 = a(env)
+                    exp2 = b(env)
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    return exp1 - exp2
+            case 'DIV':
+                def binary(env):
+                    exp1 = a(env)
+                    exp2 = b(env)
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    return exp1 // exp2
+            case 'MOD':
+                def binary(env):
+                    exp1 = a(env)
+                    exp2 = b(env)
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    return exp1 % exp2
+            case 'GREATER':
+                def binary(env):
+                    exp1 = a(env)
+                    exp2 = b(env)
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    return exp1 > exp2
+            case 'LESS':
+                def binary(env):
+                    exp1 = a(env)
+                    exp2 = b(env)
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    return exp1 < exp2
+        return binary
+
+    def compile_plus(self, node: Node):
+        if len(node.children) == 2:
+            a, b = self.compile_children(node)
+            if node.proven:
+                return lambda env: a(env) + b(env)
+
+            def plus(env):
+                exp1 = a(env)
+                exp2 = b(env)
+                if type(exp1) is not type(exp2):
+                    raise TypeError
+                return exp1 + exp2
+            return plus
+        operands = self.compile_children(node)
+        checked = not node.proven
+        check_operands = self.check_operands
+
+        def plus(env):
+            values = []
+            for operand in operands:
+                values.append(operand(env))
+            if checked:
+                check_operands(values)
+            res = 0
+            for value in values:
+                res += value
+            return res
+        return plus
+
+    def compile_mul(self, node: Node):
+        if len(node.children) == 2:
+            a, b = self.compile_children(node)
+            if node.proven:
+                return lambda env: a(env) * b(env)
+
+            def mul(env):
+                exp1 = a(env)
+                exp2 = b(env)
+                if type(exp1) is not type(exp2):
+                    raise TypeError
+                return exp1 * exp2
+            return mul
+        operands = self.compile_children(node)
+        checked = not node.proven
+        check_operands = self.check_operands
+
+        def mul(env):
+            values = []
+            for operand in operands:
+                values.append(operand(env))
+            if checked:
+                check_operands(values)
+            res = 1
+            for value in values:
+                res *= value
+            return res
+        return mul
+
+    def compile_equal(self, node: Node):
+        operands = self.compile_children(node)
+        checked = not node.proven
+        check_operands = self.check_operands
+
+        def equal(env):
+            values = []
+            for operand in operands:
+                values.append(operand(env))
+            if checked:
+                check_operands(values)
+            first = values[0]
+            for value in values:
+                if value != first:
+                    return False
+            return True
+        return equal
+
+    def compile_and(self, node: Node):
+        if not self.interpreter.strict:
+            return self.compile_short_circuit(node, True)
+        operands = self.compile_children(node)
+        checked = not node.proven
+        check_operands = self.check_operands
+
+        def logical_and(env):
+            values = []
+            for operand in operands:
+                values.append(operand(env))
+            if checked:
+                check_operands(values)
+            res = True
+            for value in values:
+                res = res and value
+            return res
+        return logical_and
+
+    def compile_or(self, node: Node):
+        if not self.interpreter.strict:
+            return self.compile_short_circuit(node, False)
+        operands = self.compile_children(node)
+        checked = not node.proven
+        check_operands = self.check_operands
+
+        def logical_or(env):
+            values = []
+            for operand in operands:
+                values.append(operand(env))
+            if checked:
+                check_operands(values)
+            res = False
+            for value in values:
+                res = res or value
+            return res
+        return logical_or
+
+    def compile_short_circuit(self, node: Node, is_and):
+        first, *rest = self.compile_children(node)
+        if node.proven:
+            def short_circuit(env):
+                res = first(env)
+                for operand in rest:
+                    if bool(res) is not is_and:
+                        break
+                    res = operand(env)
+                return res
+            return short_circuit
+
+        def short_circuit(env):
+            res = first(env)
+            value_type = type(res)
+            for operand in rest:
+                if bool(res) is not is_and:
+                    break
+                res = operand(env)
+                if type(res) is not value_type:
+                    raise TypeError
+            return res
+        return short_circuit
+
+    def compile_not(self, node: Node):
+        a = self.compile(node.children[0])
+        if node.proven:
+            return lambda env: not a(env)
+
+        def logical_not(env):
+            exp1 = a(env)
+            if type(exp1) is not bool:
+                raise TypeError
+            return not exp1
+        return logical_not
+
+    def compile_print_num(self, node: Node):
+        a = self.compile(node.children[0])
+        emit = self.interpreter.emit
+        if node.proven:
+            return lambda env: emit(a(env))
+
+        def print_num(env):
+            res = a(env)
+            if type(res) is not int:
+                raise TypeError
+            emit(res)
+        return print_num
+
+    def compile_print_bool(self, node: Node):
+        a = self.compile(node.children[0])
+        emit = self.interpreter.emit
+        if node.proven:
+            return lambda env: emit('#t' if a(env) else '#f')
+
+        def print_bool(env):
+            res = a(env)
+            if type(res) is not bool:
+                raise TypeError
+            if res:
+                emit('#t')
+            else:
+                emit('#f')
+        return print_bool
+
+    def compile_constant(self, node: Node):
+        value = node.value
+        return lambda env: value
+
+    def compile_if_exp(self, node: Node, tail=False):
+        if tail:
+            test = self.compile(node.children[0])
+            then = self.compile_tail(node.children[1])
+            otherwise = self.compile_tail(node.children[2])
+        else:
+            test, then, otherwise = self.compile_children(node)
+        if node.proven:
+            def if_exp(env):
+                if test(env):
+                    return then(env)
+                return otherwise(env)
+            return if_exp
+
+        def if_exp(env):
+            res = test(env)
+            if type(res) is not bool:
+                raise TypeError
+            if res:
+                return then(env)
+            return otherwise(env)
+        return if_exp
+
+    def compile_def(self, node: Node):
+        name = node.value
+        exp = node.children[0]
+        if exp.type == 'FUN_EXP':
+            # 函式本體在這裡編譯一次，之後每次呼叫都重複使用
+            body = self.compile_function(exp)
+            if node.address is None:
+                function_dict = self.interpreter.function_dict
+                memo = self.interpreter.memo
+                calls = makes_calls(exp)
+
+                def define_function(env):
+                    function_dict[name] = Function(name, exp.value, exp, None, body)
+                    memo.define(name, calls)
+                return define_function
+            index = node.address[1] + 1
+
+            def define_local_function(env):
+                # 巢狀函式記住定義它的 env
+                env[index] = Function(name, exp.value, exp, env, body)
+            return define_local_function
+        value = self.compile(exp)
+        if node.address is None:
+            variable_dict = self.interpreter.variable_dict
+            memo = self.interpreter.memo
+
+            def define_variable(env):
+                variable_dict[name] = value(env)
+                memo.assign(name)
+            return define_variable
+        index = node.address[1] + 1
+
+        def define_local_variable(env):
+            env[index] = value(env)
+        return define_local_variable
+
+    def compile_function(self, fun_exp: Node):
+        # 回傳的 closure 接受已經放好參數的 env，先執行函式內的定義再計算函式本體
+        defines = [self.compile(define) for define in fun_exp.children[:-1]]
+        body = self.compile_tail(fun_exp.children[-1])
+        if not defines:
+            return body
+
+        def function_body(env):
+            for define in defines:
+                define(env)
+            return body(env)
+        return function_body
+
+    def compile_variable(self, node: Node):
+        if node.address is not None:
+            return self.variable_getter(*node.address)
+        name = node.value
+        variable_dict = self.interpreter.variable_dict
+        return lambda env: variable_dict[name]
+
+    @staticmethod
+    def variable_getter(depth, index):
+        index += 1
+        if depth == 0:
+            return lambda env: env[index]
+        if depth == 1:
+            return lambda env: env[0][index]
+
+        def variable(env):
+            for _ in range(depth):
+                env = env[0]
+            return env[index]
+        return variable
+
+    def compile_fun_call_anonymous(self, node: Node, tail=False):
+        fun_exp = node.children[0]
+        body = self.compile_function(fun_exp)
+        args = [self.compile(arg) for arg in node.children[1:]]
+        if tail:
+            def tail_call_anonymous(env):
+                # 匿名函式的外層是目前的 env
+                return TailCall(Function('_', fun_exp.value, fun_exp, env, body), [arg(env) for arg in args])
+            return tail_call_anonymous
+        param_cnt = len(fun_exp.value)
+        local_slots = [None] * (len(fun_exp.children) - 1)
+        call = self.call
+
+        def fun_call_anonymous(env):
+            frame = [env]
+            for arg in args:
+                frame.append(arg(env))
+            if len(frame) <= param_cnt:
+                arity_error(param_cnt, len(frame) - 1)
+            del frame[param_cnt + 1:]
+            frame.extend(local_slots)
+            result = body(frame)
+            if result.__class__ is TailCall:
+                return call(result.function, result.args)
+            return result
+        return fun_call_anonymous
+
+    def compile_fun_call_defined(self, node: Node, tail=False):
+        name = node.value
+        args = [self.compile(arg) for arg in node.children]
+        call = self.call
+        if node.address is not None:
+            # 巢狀函式：不使用 memo
+            get_function = self.variable_getter(*node.address)
+            if tail:
+                def tail_call_local(env):
+                    values = [arg(env) for arg in args]
+                    return TailCall(get_function(env), values)
+                return tail_call_local
+
+            def fun_call_local(env):
+                values = [arg(env) for arg in args]
+                return call(get_function(env), values)
+            return fun_call_local
+        function_dict = self.interpreter.function_dict
+        memo = self.interpreter.memo
+
+        def fun_call_defined(env):
+            values = [arg(env) for arg in args]
+            fun = function_dict[name]
+            if len(values) < len(fun.params):
+                arity_error(len(fun.params), len(values))
+            key, result = memo.lookup(name, values)
+            if result is not NOT_CACHED:
+                return result
+            if tail:
+                return TailCall(fun, values)
+            result = call(fun, values)
+            if key is not None:
+                memo.store(key, result)
+            return result
+        return fun_call_defined
+
+    @staticmethod
+    def call(fun: Function, values):
+        # 執行函式，函式本體回傳 TailCall 時在這個迴圈中接著執行，不增加 Python 的遞迴深度
+        while True:
+            param_cnt = len(fun.params)
+            if len(values) < param_cnt:
+                arity_error(param_cnt, len(values))
+            # frame：[外層 env, 參數..., 函式內的定義...]
+            del values[param_cnt:]
+            values.insert(0, fun.parent)
+            values.extend([None] * (len(fun.fun_exp.children) - 1))
+            result = fun.body(values)
+            if result.__class__ is not TailCall:
+                return result
+            fun = result.function
+            values = result.args
+
+    def compile_fun_exp(self, node: Node):
+        return lambda env: None
+
+
+# --- Bytecode backend ---
+# 指令是 opcode 後面接固定個數的運算元，全部攤平放在 Code.ops 這個整數串列裡
+OPCODE_NAMES = (
+    'LOAD_CONST', 'LOAD_LOCAL', 'LOAD_OUTER', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'DEFINE_FUNCTION',
+    'SUB', 'DIV', 'MOD', 'GREATER', 'LESS', 'ADD', 'MUL', 'EQUAL', 'AND', 'OR', 'NOT',
+    'PRINT_NUM', 'PRINT_BOOL', 'JUMP', 'POP_JUMP_IF_FALSE', 'CALL', 'CALL_ANONYMOUS', 'RETURN',
+    'STORE_LOCAL', 'MAKE_CLOSURE', 'CALL_LOCAL', 'TAIL_CALL', 'TAIL_CALL_ANONYMOUS', 'TAIL_CALL_LOCAL',
+    'SHORT_AND', 'SHORT_OR', 'REPLACE_SAME_TYPE',
+)
+(OP_LOAD_CONST, OP_LOAD_LOCAL, OP_LOAD_OUTER, OP_LOAD_GLOBAL, OP_STORE_GLOBAL, OP_DEFINE_FUNCTION,
+ OP_SUB, OP_DIV, OP_MOD, OP_GREATER, OP_LESS, OP_ADD, OP_MUL, OP_EQUAL, OP_AND, OP_OR, OP_NOT,
+ OP_PRINT_NUM, OP_PRINT_BOOL, OP_JUMP, OP_POP_JUMP_IF_FALSE, OP_CALL, OP_CALL_ANONYMOUS, OP_RETURN,
+ OP_STORE_LOCAL, OP_MAKE_CLOSURE, OP_CALL_LOCAL, OP_TAIL_CALL, OP_TAIL_CALL_ANONYMOUS, OP_TAIL_CALL_LOCAL,
+ OP_SHORT_AND, OP_SHORT_OR, OP_REPLACE_SAME_TYPE) = range(33)
+# 每個 opcode 後面的運算元個數
+#   LOAD_CONST const / LOAD_LOCAL index / LOAD_OUTER depth index / LOAD_GLOBAL name / STORE_GLOBAL name
+#   DEFINE_FUNCTION name const / ADD MUL EQUAL AND OR 運算元個數 / JUMP POP_JUMP_IF_FALSE 目標位置
+#   CALL name 引數個數 / CALL_ANONYMOUS const 引數個數 / STORE_LOCAL index / MAKE_CLOSURE const
+#   CALL_LOCAL depth index 引數個數 / TAIL_CALL* 與對應的 CALL* 相同 / SHORT_AND SHORT_OR 目標位置
+# SUB 到 LESS 是二元運算，ADD 到 OR 是多元運算，VM 以範圍判斷
+OPERAND_COUNTS = (1, 1, 2, 1, 1, 2, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 2, 2, 0, 1, 1, 3, 2, 2, 3, 1, 1, 0)
+BINARY_OPCODES = {'MINUS': OP_SUB, 'DIV': OP_DIV, 'MOD': OP_MOD, 'GREATER': OP_GREATER, 'LESS': OP_LESS}
+VARIADIC_OPCODES = {'PLUS': OP_ADD, 'MUL': OP_MUL, 'EQUAL': OP_EQUAL, 'AND': OP_AND, 'OR': OP_OR}
+
+
+class Code:
+    """一段編譯好的 bytecode：一個最上層的敘述或一個函式本體"""
+
+    def __init__(self, name, params=(), local_names=()):
+        self.name = name
+        self.params = params
+        # 函式內 define 的名字，frame 中接在參數之後
+        self.local_names = local_names
+        # 函式本體是否呼叫函式，決定 Memo 是否快取這個函式
+        self.makes_calls = False
+        self.ops = []
+        # 常數與名稱放在旁邊的表，指令裡只存索引
+        self.consts = []
+        self.names = []
+
+    def const_index(self, value):
+        # 函式的 Code 每個都不同，數字與布林值相同就共用；True == 1，所以連型別一起比較
+        for i, const in enumerate(self.consts):
+            if type(const) is type(value) and const == value:
+                return i
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name_index(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def emit(self, op, *operands):
+        self.ops.append(op)
+        self.ops.extend(operands)
+        return len(self.ops) - 1
+
+    def __repr__(self):
+        return f'<Code {self.name} params={self.params!r} {len(self.ops)} ops>'
+
+
+class BytecodeCompiler:
+    """
+    把 AST 編譯成 Code，變數依 resolve() 決定的 (depth, index) 直接從 frame 取值。
+    strict 為 False 時 and/or 編譯成 SHORT_AND/SHORT_OR 跳躍，否則和其他多元運算一樣計算所有運算元。
+    """
+
+    def __init__(self, strict=False):
+        self.strict = strict
+
+    def compile(self, stmt: Node):
+        code = Code('<stmt>')
+        self.compile_node(stmt, code)
+        if stmt.type in ('PRINT_NUM', 'PRINT_BOOL', 'DEF'):
+            # 這些敘述沒有值
+            code.emit(OP_LOAD_CONST, code.const_index(None))
+        code.emit(OP_RETURN)
+        return code
+
+    def compile_function(self, fun_exp: Node, name):
+        defines = fun_exp.children[:-1]
+        code = Code(name, fun_exp.value, tuple(define.value for define in defines))
+        code.makes_calls = makes_calls(fun_exp)
+        for define in defines:
+            self.compile_node(define, code)
+        self.compile_node(fun_exp.children[-1], code, tail=True)
+        code.emit(OP_RETURN)
+        return code
+
+    def compile_node(self, node: Node, code: Code, tail=False):
+        # tail 為 True 表示 node 在尾端位置：函式本體或其中 if 的分支，呼叫改用 TAIL_CALL*
+        node_type = node.type
+        if node_type in ('NUMBER', 'BOOL'):
+            code.emit(OP_LOAD_CONST, code.const_index(node.value))
+        elif node_type == 'VARIABLE':
+            if node.address is None:
+                code.emit(OP_LOAD_GLOBAL, code.name_index(node.value))
+            elif node.address[0] == 0:
+                code.emit(OP_LOAD_LOCAL, node.address[1] + 1)
+            else:
+                code.emit(OP_LOAD_OUTER, node.address[0], node.address[1] + 1)
+        elif node_type in BINARY_OPCODES:
+            for child in node.children:
+                self.compile_node(child, code)
+            code.emit(BINARY_OPCODES[node_type])
+        elif node_type in ('AND', 'OR') and not self.strict:
+            # 到目前為止的結果留在 stack 頂端，結果確定時跳到最後
+            self.compile_node(node.children[0], code)
+            jumps = []
+            for child in node.children[1:]:
+                jumps.append(code.emit(OP_SHORT_AND if node_type == 'AND' else OP_SHORT_OR, 0))
+                self.compile_node(child, code)
+                code.emit(OP_REPLACE_SAME_TYPE)
+            for jump in jumps:
+                code.ops[jump] = len(code.ops)
+        elif node_type in VARIADIC_OPCODES:
+            for child in node.children:
+                self.compile_node(child, code)
+            code.emit(VARIADIC_OPCODES[node_type], len(node.children))
+        elif node_type == 'NOT':
+            self.compile_node(node.children[0], code)
+            code.emit(OP_NOT)
+        elif node_type == 'IF_EXP':
+            test, then, otherwise = node.children
+            self.compile_node(test, code)
+            jump_to_else = code.emit(OP_POP_JUMP_IF_FALSE, 0)
+            self.compile_node(then, code, tail)
+            jump_to_end = code.emit(OP_JUMP, 0)
+            code.ops[jump_to_else] = len(code.ops)
+            self.compile_node(otherwise, code, tail)
+            code.ops[jump_to_end] = len(code.ops)
+        elif node_type == 'FUN_CALL_DEFINED':
+            for child in node.children:
+                self.compile_node(child, code)
+            if node.address is None:
+                code.emit(OP_TAIL_CALL if tail else OP_CALL, code.name_index(node.value), len(node.children))
+            else:
+                code.emit(OP_TAIL_CALL_LOCAL if tail else OP_CALL_LOCAL,
+                          node.address[0], node.address[1] + 1, len(node.children))
+        elif node_type == 'FUN_CALL_ANONYMOUS':
+            fun_exp = node.children[0]
+            for child in node.children[1:]:
+                self.compile_node(child, code)
+            function = self.compile_function(fun_exp, '_')
+            code.emit(OP_TAIL_CALL_ANONYMOUS if tail else OP_CALL_ANONYMOUS,
+                      code.const_index(function), len(node.children) - 1)
+        elif node_type == 'PRINT_NUM':
+            self.compile_node(node.children[0], code)
+            code.emit(OP_PRINT_NUM)
+        elif node_type == 'PRINT_BOOL':
+            self.compile_node(node.children[0], code)
+            code.emit(OP_PRINT_BOOL)
+        elif node_type == 'DEF':
+            exp = node.children[0]
+            if exp.type == 'FUN_EXP':
+                # 函式本體在這裡編譯一次
+                function = self.compile_function(exp, node.value)
+                if node.address is None:
+                    code.emit(OP_DEFINE_FUNCTION, code.name_index(node.value), code.const_index(function))
+                else:
+                    code.emit(OP_MAKE_CLOSURE, code.const_index(function))
+                    code.emit(OP_STORE_LOCAL, node.address[1] + 1)
+            else:
+                self.compile_node(exp, code)
+                if node.address is None:
+                    code.emit(OP_STORE_GLOBAL, code.name_index(node.value))
+                else:
+                    code.emit(OP_STORE_LOCAL, node.address[1] + 1)
+        elif node_type == 'FUN_EXP':
+            code.emit(OP_LOAD_CONST, code.const_index(None))
 
-if IS_VALID_SYNTAX:
-    try:
-        travel_ast(ast)
-    except TypeError:
-        print("Type error!")
-    if IS_DEBUG:
-        print('---' * 10)
-        print("Variable Dictionary:")
-        print(variable_dict)
-        print("Function Dictionary:")
-        print(function_dict)
-        print("Function Stack:")
-        print(fun_stack)
-        print("Status Stack:")
-        print(status_stack)
-else:
-    print("syntax error")
+
+class VirtualMachine:
+    """
+    執行 Code 的堆疊機。運算元放在 stack，呼叫函式時把目前的 Code、pc 與 env 推進 frames，
+    函式呼叫不會增加 Python 的遞迴深度；尾端呼叫（TAIL_CALL*）不推入 frames。
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.compiler = BytecodeCompiler(interpreter.strict)
+
+    def evaluate(self, stmt: Node):
+        return self.run(self.compiler.compile(stmt))
+
+    def run(self, code: Code):
+        interpreter = self.interpreter
+        variable_dict = interpreter.variable_dict
+        function_dict = interpreter.function_dict
+        memo = interpreter.memo
+        emit = interpreter.emit
+        stack = []
+        # 呼叫者的 (Code, pc, env, memo 的 key)
+        frames = []
+        ops = code.ops
+        consts = code.consts
+        names = code.names
+        env = None
+        memo_key = None
+        pc = 0
+        while True:
+            op = ops[pc]
+            if op == OP_LOAD_LOCAL:
+                stack.append(env[ops[pc + 1]])
+                pc += 2
+            elif op == OP_LOAD_CONST:
+                stack.append(consts[ops[pc + 1]])
+                pc += 2
+            elif op == OP_POP_JUMP_IF_FALSE:
+                test = stack.pop()
+                if type(test) is not bool:
+                    raise TypeError
+                if test:
+                    pc += 2
+                else:
+                    pc = ops[pc + 1]
+            elif op == OP_JUMP:
+                pc = ops[pc + 1]
+            elif OP_SUB <= op <= OP_LESS:
+                exp2 = stack.pop()
+                exp1 = stack[-1]
+                if type(exp1) is not type(exp2):
+                    raise TypeError
+                if op == OP_SUB:
+                    stack[-1] = exp1 - exp2
+                elif op == OP_LESS:
+                    stack[-1] = exp1 < exp2
+                elif op == OP_GREATER:
+                    stack[-1] = exp1 > exp2
+                elif op == OP_DIV:
+                    stack[-1] = exp1 // exp2
+                else:
+                    stack[-1] = exp1 % exp2
+                pc += 1
+            elif op == OP_CALL or op == OP_TAIL_CALL:
+                name = names[ops[pc + 1]]
+                argc = ops[pc + 2]
+                pc += 3
+                fun = function_dict[name]
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+                if argc < len(fun.params):
+                    arity_error(len(fun.params), argc)
+                key, result = memo.lookup(name, args)
+                if result is not NOT_CACHED:
+                    stack.append(result)
+                    continue
+                if op == OP_CALL:
+                    frames.append((code, pc, env, memo_key))
+                    memo_key = key
+                # 尾端呼叫不推入 frames，直接取代目前的函式；memo 只記錄最外層的呼叫
+                code = fun.body
+                ops = code.ops
+                consts = code.consts
+                names = code.names
+                # frame：[外層 env, 參數..., 函式內 define 的名字...]
+                env = [None] + args[:len(code.params)] + [None] * len(code.local_names)
+                pc = 0
+            elif op == OP_RETURN:
+                if not frames:
+                    return stack.pop()
+                # 回傳值留在 stack 頂端給呼叫者
+                if memo_key is not None:
+                    memo.store(memo_key, stack[-1])
+                code, pc, env, memo_key = frames.pop()
+                ops = code.ops
+                consts = code.consts
+                names = code.names
+            elif OP_ADD <= op <= OP_OR:
+                # ADD MUL EQUAL AND OR：一次取出所有運算元
+                count = ops[pc + 1]
+                pc += 2
+                if count == 2 and op <= OP_MUL:
+                    # 最常見的兩個運算元的加法與乘法
+                    exp2 = stack.pop()
+                    exp1 = stack[-1]
+                    if type(exp1) is not type(exp2):
+                        raise TypeError
+                    if op == OP_ADD:
+                        stack[-1] = exp1 + exp2
+                    else:
+                        stack[-1] = exp1 * exp2
+                    continue
+                values = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                value_type = type(values[0])
+                for value in values:
+                    if type(value) is not value_type:
+                        raise TypeError
+                if op == OP_ADD:
+                    res = 0
+                    for value in values:
+                        res += value
+                elif op == OP_MUL:
+                    res = 1
+                    for value in values:
+                        res *= value
+                elif op == OP_EQUAL:
+                    res = True
+                    for value in values:
+                        if value != values[0]:
+                            res = False
+                            break
+                elif op == OP_AND:
+                    res = True
+                    for value in values:
+                        res = res and value
+                else:
+                    res = False
+                    for value in values:
+                        res = res or value
+                stack.append(res)
+            elif op == OP_NOT:
+                exp1 = stack[-1]
+                if type(exp1) is not bool:
+                    raise TypeError
+                stack[-1] = not exp1
+                pc += 1
+            elif op == OP_LOAD_OUTER:
+                outer = env
+                for _ in range(ops[pc + 1]):
+                    outer = outer[0]
+                stack.append(outer[ops[pc + 2]])
+                pc += 3
+            elif op == OP_LOAD_GLOBAL:
+                stack.append(variable_dict[names[ops[pc + 1]]])
+                pc += 2
+            elif op == OP_CALL_ANONYMOUS or op == OP_TAIL_CALL_ANONYMOUS:
+                function = consts[ops[pc + 1]]
+                argc = ops[pc + 2]
+                pc += 3
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+                if argc < len(function.params):
+                    arity_error(len(function.params), argc)
+                if op == OP_CALL_ANONYMOUS:
+                    frames.append((code, pc, env, memo_key))
+                    memo_key = None
+                env = [env] + args[:len(function.params)] + [None] * len(function.local_names)
+                code = function
+                ops = code.ops
+                consts = code.consts
+                names = code.names
+                pc = 0
+            elif op == OP_PRINT_NUM:
+                res = stack.pop()
+                if type(res) is not int:
+                    raise TypeError
+                emit(res)
+                pc += 1
+            elif op == OP_PRINT_BOOL:
+                res = stack.pop()
+                if type(res) is not bool:
+                    raise TypeError
+                if res:
+                    emit('#t')
+                else:
+                    emit('#f')
+                pc += 1
+            elif op == OP_STORE_GLOBAL:
+                name = names[ops[pc + 1]]
+                variable_dict[name] = stack.pop()
+                memo.assign(name)
+                pc += 2
+            elif op == OP_DEFINE_FUNCTION:
+                name = names[ops[pc + 1]]
+                function = consts[ops[pc + 2]]
+                function_dict[name] = Function(name, function.params, None, None, function)
+                memo.define(name, function.makes_calls)
+                pc += 3
+            elif op == OP_STORE_LOCAL:
+                env[ops[pc + 1]] = stack.pop()
+                pc += 2
+            elif op == OP_SHORT_AND:
+                # and 的結果已經是假值，其餘的運算元不必計算
+                if stack[-1]:
+                    pc += 2
+                else:
+                    pc = ops[pc + 1]
+            elif op == OP_SHORT_OR:
+                if stack[-1]:
+                    pc = ops[pc + 1]
+                else:
+                    pc += 2
+            elif op == OP_REPLACE_SAME_TYPE:
+                # 新的運算元成為結果，型別必須與先前的結果（也就是第一個運算元）相同
+                res = stack.pop()
+                if type(res) is not type(stack[-1]):
+                    raise TypeError
+                stack[-1] = res
+                pc += 1
+            elif op == OP_MAKE_CLOSURE:
+                function = consts[ops[pc + 1]]
+                stack.append(Function(function.name, function.params, None, env, function))
+                pc += 2
+            elif op == OP_CALL_LOCAL or op == OP_TAIL_CALL_LOCAL:
+                # 函式內 define 的函式：不經過 function_dict 也不使用 memo
+                outer = env
+                for _ in range(ops[pc + 1]):
+                    outer = outer[0]
+                fun = outer[ops[pc + 2]]
+                argc = ops[pc + 3]
+                pc += 4
+                function = fun.body
+                args = stack[len(stack) - argc:]
+                del stack[len(stack) - argc:]
+                if argc < len(function.params):
+                    arity_error(len(function.params), argc)
+                if op == OP_CALL_LOCAL:
+                    frames.append((code, pc, env, memo_key))
+                    memo_key = None
+                env = [fun.parent] + args[:len(function.params)] + [None] * len(function.local_names)
+                code = function
+                ops = code.ops
+                consts = code.consts
+                names = code.names
+                pc = 0
+
+
+def disassemble(code: Code, file=None):
+    """印出 code 與其中所有函式的指令，格式為 位置 指令 運算元 (常數或名稱)"""
+    print(f'Disassembly of {code!r}:', file=file)
+    functions = []
+    pc = 0
+    while pc < len(code.ops):
+        op = code.ops[pc]
+        operands = code.ops[pc + 1:pc + 1 + OPERAND_COUNTS[op]]
+        note = ''
+        if op == OP_LOAD_CONST:
+            note = f'({code.consts[operands[0]]!r})'
+        elif op in (OP_LOAD_LOCAL, OP_STORE_LOCAL):
+            note = f'({(code.params + code.local_names)[operands[0] - 1]})'
+        elif op in (OP_LOAD_GLOBAL, OP_STORE_GLOBAL, OP_CALL, OP_TAIL_CALL):
+            note = f'({code.names[operands[0]]})'
+        elif op in (OP_CALL_ANONYMOUS, OP_TAIL_CALL_ANONYMOUS, OP_MAKE_CLOSURE):
+            functions.append(code.consts[operands[0]])
+            note = f'({code.consts[operands[0]]!r})'
+        elif op == OP_DEFINE_FUNCTION:
+            functions.append(code.consts[operands[1]])
+            note = f'({code.names[operands[0]]} = {code.consts[operands[1]]!r})'
+        print(f'{pc:6d} {OPCODE_NAMES[op]:<20s} {" ".join(map(str, operands)):<8s} {note}'.rstrip(), file=file)
+        pc += 1 + len(operands)
+    for function in functions:
+        print(file=file)
+        disassemble(function, file)
+
+
+# --- Python backend ---
+PYTHON_OPERATORS = {
+    'PLUS': '+', 'MINUS': '-', 'MUL': '*', 'DIV': '//', 'MOD': '%',
+    'GREATER': '>', 'LESS': '<', 'EQUAL': '==', 'AND': 'and', 'OR': 'or',
+}
+SIMPLE_PYTHON_RE = re.compile(r'\(?-?\d+\)?|True|False|None|[A-Za-z_]\w*')
+# CPython 的語法分析器最多只接受 200 層括號與 100 層縮排，產生的運算式超過這裡的括號數就先存進暫存變數，
+# if 的分支超過這裡的縮排就移到模組層級的函式
+PYTHON_MAX_PARENS = 50
+PYTHON_MAX_INDENT = 50
+
+
+class PythonTranspiler:
+    """
+    把每個最上層的敘述翻譯成 Python 原始碼，經過 compile() 之後由 CPython 執行。
+    具名函式變成 def，if 變成條件運算式（分支需要先執行敘述時改用 if 敘述），運算子變成 Python 的運算子。
+    只有在編譯時無法確定運算元型別相同時才插入型別檢查。
+    尾端位置的呼叫回傳 TailCall，由 _call() 或 _finish() 的迴圈執行，不增加 Python 的遞迴深度。
+    dump 不是 None 時，把產生的原始碼寫到 dump。
+    翻譯時每一層巢狀占用兩個 Python 堆疊（expression() 與 operands()、checked() 或 branch()），
+    所以在預設的遞迴上限下，可巢狀的深度大約是 travel_ast 的一半。
+    """
+
+    def __init__(self, interpreter, dump=None):
+        self.interpreter = interpreter
+        self.dump = dump
+        self.counter = 0
+        self.lines = []
+        self.indent = 0
+        self.helpers = []
+        # 依序記錄產生的名字與查詢 scopes 用到的名字，hoist() 以此找出分支用到、但在分支外綁定的名字
+        self.created = []
+        self.used = []
+        function_dict = interpreter.function_dict
+        memo = interpreter.memo
+
+        def call(name, args):
+            # 具名函式呼叫
+            fun = function_dict[name]
+            param_cnt = len(fun.params)
+            if len(args) < param_cnt:
+                arity_error(param_cnt, len(args))
+            key, result = memo.lookup(name, args)
+            if result is not NOT_CACHED:
+                return result
+            result = finish(fun.body(*args[:param_cnt]))
+            if key is not None:
+                memo.store(key, result)
+            return result
+
+        def tail_call(name, args):
+            # 尾端位置的具名函式呼叫
+            fun = function_dict[name]
+            param_cnt = len(fun.params)
+            if len(args) < param_cnt:
+                arity_error(param_cnt, len(args))
+            _, result = memo.lookup(name, args)
+            if result is not NOT_CACHED:
+                return result
+            return TailCall(fun.body, args[:param_cnt])
+
+        def finish(result):
+            # 執行函式本體回傳的尾端呼叫，直到得到真正的值
+            while result.__class__ is TailCall:
+                result = result.function(*result.args)
+            return result
+
+        def define(name, params, body, calls):
+            function_dict[name] = Function(name, params, None, None, body)
+            memo.define(name, calls)
+
+        # 產生的程式碼中的名字都是 _ 開頭的輔助函式、t<n> 暫存變數、p<n>_ 參數、l<n>_ 函式內的 define 與 _fun<n> 函式，
+        # 不會互相衝突
+        self.namespace = {
+            '_G': interpreter.variable_dict,
+            '_call': call,
+            '_tail_call': tail_call,
+            '_finish': finish,
+            '_TailCall': TailCall,
+            '_define': define,
+            '_assign': memo.assign,
+            '_emit': interpreter.emit,
+            '_arity_error': arity_error,
+        }
+
+    def evaluate(self, stmt: Node):
+        return self.compile(stmt)()
+
+    def compile(self, stmt: Node):
+        source = self.transpile(stmt)
+        if self.dump is not None:
+            print(source, file=self.dump)
+        # 每個敘述用自己的全域命名空間，產生的 def 不會累積下來
+        namespace = dict(self.namespace)
+        exec(compile(source, '<mini-lisp>', 'exec'), namespace)
+        return namespace['_stmt']
+
+    def transpile(self, stmt: Node):
+        """回傳定義 _stmt() 的 Python 原始碼，呼叫 _stmt() 就會執行 stmt 並回傳它的值"""
+        self.lines = []
+        self.indent = 0
+        # 移到模組層級的分支
+        self.helpers = []
+        self.created = []
+        self.used = []
+        if stmt.type == 'DEF' and stmt.children[0].type == 'FUN_EXP':
+            # 最上層的具名函式直接產生模組層級的 def
+            fun_exp = stmt.children[0]
+            fun_name = self.function(fun_exp, ())
+            self.line('def _stmt():')
+            self.indent = 1
+            self.line(f'_define({stmt.value!r}, {fun_exp.value!r}, {fun_name}, {makes_calls(fun_exp)})')
+            self.line('return None')
+        else:
+            self.line('def _stmt():')
+            self.indent = 1
+            value = self.statement(stmt)
+            self.line(f'return {value}')
+        return '\n'.join(self.helpers + self.lines) + '\n'
+
+    def line(self, text):
+        self.lines.append('    ' * self.indent + text)
+
+    def new_name(self, prefix, suffix=''):
+        self.counter += 1
+        name = f'{prefix}{self.counter}{suffix}'
+        self.created.append(name)
+        return name
+
+    def lookup(self, scopes, address):
+        # 依 resolve() 的位址找出函式內的名字，並記錄在 used
+        depth, index = address
+        entry = scopes[-1 - depth][index]
+        self.used.append(entry[0])
+        return entry
+
+    def nested(self, code):
+        # 括號太多的運算式先存進暫存變數，再深的巢狀也不會超過 CPython 語法分析器的限制
+        if code.count('(') > PYTHON_MAX_PARENS:
+            return self.temp(code)
+        return code
+
+    def temp(self, code):
+        # 把 code 的值先存進暫存變數，回傳暫存變數的名字
+        if SIMPLE_PYTHON_RE.fullmatch(code):
+            return code
+        name = self.new_name('t')
+        self.line(f'{name} = {code}')
+        return name
+
+    def statement(self, stmt: Node):
+        if stmt.type == 'PRINT_NUM':
+            value = self.checked(stmt.children[0], (), int)
+            self.line(f'_emit({value})')
+            return 'None'
+        elif stmt.type == 'PRINT_BOOL':
+            value = self.checked(stmt.children[0], (), bool)
+            self.line(f"_emit('#t' if {value} else '#f')")
+            return 'None'
+        elif stmt.type == 'DEF':
+            value, _ = self.expression(stmt.children[0], ())
+            self.line(f'_G[{stmt.value!r}] = {value}')
+            self.line(f'_assign({stmt.value!r})')
+            return 'None'
+        value, _ = self.expression(stmt, ())
+        return value
+
+    def function(self, fun_exp: Node, scopes):
+        # 產生 def，回傳函式的名字；參數與函式內的 define 改名為合法且不會衝突的 Python 名字
+        # scopes 由外到內，每層依 resolve() 的 index 排列 (Python 名字, 函式的參數個數或 None, 是否會回傳 TailCall)
+        fun_name = self.new_name('_fun')
+        defines = fun_exp.children[:-1]
+        names = [self.new_name('p', '_' + re.sub(r'\W', '_', param)) for param in fun_exp.value]
+        local_names = [self.new_name('l', '_' + re.sub(r'\W', '_', define.value)) for define in defines]
+        scope = [(name, None, False) for name in names]
+        for name, define in zip(local_names, defines):
+            exp = define.children[0]
+            if exp.type == 'FUN_EXP':
+                scope.append((name, len(exp.value), self.has_tail_call(exp.children[-1])))
+            else:
+                scope.append((name, None, False))
+        scopes = scopes + (scope,)
+        self.line(f'def {fun_name}({", ".join(names)}):')
+        self.indent += 1
+        if local_names:
+            self.line(f'{" = ".join(local_names)} = None')
+        for name, define in zip(local_names, defines):
+            exp = define.children[0]
+            if exp.type == 'FUN_EXP':
+                self.line(f'{name} = {self.function(exp, scopes)}')
+            else:
+                value, _ = self.expression(exp, scopes)
+                self.line(f'{name} = {value}')
+        value, _ = self.expression(fun_exp.children[-1], scopes, tail=True)
+        self.line(f'return {value}')
+        self.indent -= 1
+        return fun_name
+
+    @staticmethod
+    def has_tail_call(node: Node):
+        # 函式本體 node 的尾端位置有呼叫時，產生的函式可能回傳 TailCall
+        while node.type == 'IF_EXP':
+            if PythonTranspiler.has_tail_call(node.children[1]):
+                return True
+            node = node.children[2]
+        return node.type in ('FUN_CALL_DEFINED', 'FUN_CALL_ANONYMOUS')
+
+    @staticmethod
+    def call_code(function, args, tail, returns_tail_call):
+        # 直接呼叫 function 的程式碼；尾端位置改為回傳 TailCall
+        if tail:
+            return f'_TailCall({function}, ({"".join(arg + ", " for arg in args)}))'
+        if returns_tail_call:
+            return f'_finish({function}({", ".join(args)}))'
+        return f'{function}({", ".join(args)})'
+
+    def checked(self, node: Node, scopes, value_type):
+        # 計算 node，值的型別不是 value_type 時拋出 TypeError
+        value, static_type = self.expression(node, scopes)
+        if static_type is not value_type:
+            value = self.temp(value)
+            self.line(f'if type({value}) is not {value_type.__name__}:')
+            self.line('    raise TypeError')
+        return value
+
+    def operands(self, nodes, scopes):
+        # 依序計算所有運算元，回傳 (程式碼, 靜態型別) 的串列
+        # 後面的運算元需要先執行敘述時，前面尚未計算的運算元先存進暫存變數，保持計算順序
+        results = []
+        for node in nodes:
+            before = len(self.lines)
+            code, static_type = self.expression(node, scopes)
+            if len(self.lines) > before:
+                pending = [i for i, (value, _) in enumerate(results) if not SIMPLE_PYTHON_RE.fullmatch(value)]
+                if pending:
+                    emitted = self.lines[before:]
+                    del self.lines[before:]
+                    for i in pending:
+                        results[i] = (self.temp(results[i][0]), results[i][1])
+                    self.lines.extend(emitted)
+            results.append((code, static_type))
+        return results
+
+    def expression(self, node: Node, scopes, tail=False):
+        """
+        回傳 (Python 運算式, 靜態型別)，靜態型別是 int、bool 或未知的 None；需要的敘述會先寫進 self.lines。
+        變數與呼叫的靜態型別來自 infer_types() 記錄的 value_type。
+        tail 為 True 表示 node 在函式本體的尾端位置，其中的呼叫產生 TailCall。
+        """
+        node_type = node.type
+        if node_type == 'NUMBER':
+            return (f'({node.value})' if node.value < 0 else str(node.value)), int
+        elif node_type == 'BOOL':
+            return ('True' if node.value else 'False'), bool
+        elif node_type == 'VARIABLE':
+            if node.address is not None:
+                return self.lookup(scopes, node.address)[0], node.value_type
+            return f'_G[{node.value!r}]', node.value_type
+        elif node_type in ('AND', 'OR') and not self.interpreter.strict:
+            first = self.expression(node.children[0], scopes)
+            branches = []
+            for child in node.children[1:]:
+                branches.append(self.branch(child, scopes))
+            return self.short_circuit(node, first, branches)
+        elif node_type in PYTHON_OPERATORS:
+            operands = self.operands(node.children, scopes)
+            if node_type in ('AND', 'OR'):
+                # 先算好所有運算元，Python 的 and/or 就只是選出結果，不會略過任何計算
+                operands = [(self.temp(code), static_type) for code, static_type in operands]
+            types = {static_type for _, static_type in operands}
+            if len(types) == 1 and None not in types:
+                operand_type = types.pop()
+            else:
+                # 無法確定型別相同，先計算所有運算元再檢查型別
+                operand_type = None
+                operands = [(self.temp(code), static_type) for code, static_type in operands]
+                self.type_check(operands)
+            operator = PYTHON_OPERATORS[node_type]
+            code = self.nested(f'({f" {operator} ".join(code for code, _ in operands)})')
+            if node_type in ('GREATER', 'LESS', 'EQUAL'):
+                return code, bool
+            elif node_type in ('AND', 'OR'):
+                return code, operand_type
+            # 型別相同的 int 或 bool 做算術，結果都是 int
+            return code, int
+        elif node_type == 'NOT':
+            value = self.checked(node.children[0], scopes, bool)
+            return self.nested(f'(not {value})'), bool
+        elif node_type == 'IF_EXP':
+            test = self.checked(node.children[0], scopes, bool)
+            then_lines, (then, then_type) = self.branch(node.children[1], scopes, tail)
+            else_lines, (otherwise, else_type) = self.branch(node.children[2], scopes, tail)
+            result_type = then_type if then_type is else_type else node.value_type
+            if not then_lines and not else_lines:
+                return self.nested(f'({then} if {test} else {otherwise})'), result_type
+            result = self.new_name('t')
+            self.line(f'if {test}:')
+            self.lines.extend(then_lines)
+            self.line(f'    {result} = {then}')
+            self.line('else:')
+            self.lines.extend(else_lines)
+            self.line(f'    {result} = {otherwise}')
+            return result, result_type
+        elif node_type == 'FUN_CALL_DEFINED':
+            args = [code for code, _ in self.operands(node.children, scopes)]
+            if node.address is not None:
+                # 函式內 define 的函式：直接呼叫，不使用 memo
+                fun_name, param_cnt, returns_tail_call = self.lookup(scopes, node.address)
+                if len(args) < param_cnt:
+                    self.line(f'_arity_error({param_cnt}, {len(args)})')
+                    return 'None', None
+                code = self.call_code(fun_name, args[:param_cnt], tail, returns_tail_call)
+                return self.temp(code), node.value_type
+            args = f'({args[0]},)' if len(args) == 1 else f'({", ".join(args)})'
+            helper = '_tail_call' if tail else '_call'
+            return self.temp(f'{helper}({node.value!r}, {args})'), node.value_type
+        elif node_type == 'FUN_CALL_ANONYMOUS':
+            fun_exp = node.children[0]
+            fun_name = self.function(fun_exp, scopes)
+            args = [code for code, _ in self.operands(node.children[1:], scopes)]
+            if len(args) < len(fun_exp.value):
+                self.line(f'_arity_error({len(fun_exp.value)}, {len(args)})')
+                return 'None', None
+            code = self.call_code(fun_name, args[:len(fun_exp.value)], tail, self.has_tail_call(fun_exp.children[-1]))
+            return self.temp(code), node.value_type
+        elif node_type == 'FUN_EXP':
+            return 'None', None
+        raise ValueError(f'cannot transpile {node_type}')
+
+    def short_circuit(self, node: Node, first, branches):
+        # 短路的 and/or：運算元都不需要先執行敘述且型別都已知相同時直接用 Python 的 and/or，
+        # 否則逐一計算，每個運算元放在 if 裡，結果確定之後的 if 都不成立
+        # first 是第一個運算元的 (程式碼, 靜態型別)，branches 是其餘運算元 branch() 的結果
+        first, first_type = first
+        types = {first_type} | {static_type for _, (_, static_type) in branches}
+        operator = PYTHON_OPERATORS[node.type]
+        if not any(lines for lines, _ in branches) and len(types) == 1 and None not in types:
+            codes = [first] + [code for _, (code, _) in branches]
+            return self.nested(f'({f" {operator} ".join(codes)})'), first_type
+        result = self.new_name('t')
+        self.line(f'{result} = {first}')
+        test = result if node.type == 'AND' else f'not {result}'
+        for lines, (code, static_type) in branches:
+            self.line(f'if {test}:')
+            self.lines.extend(lines)
+            if first_type is not None and static_type is not None:
+                if first_type is not static_type:
+                    self.line('    raise TypeError')
+            else:
+                if not SIMPLE_PYTHON_RE.fullmatch(code):
+                    name = self.new_name('t')
+                    self.line(f'    {name} = {code}')
+                    code = name
+                expected = first_type.__name__ if first_type is not None else f'type({result})'
+                self.line(f'    if type({code}) is not {expected}:')
+                self.line('        raise TypeError')
+            self.line(f'    {result} = {code}')
+        return result, first_type if len(types) == 1 else node.value_type
+
+    def type_check(self, operands):
+        # 運算元的型別不全相同時拋出 TypeError；已知型別的運算元不需要在執行時檢查
+        known = {static_type for _, static_type in operands if static_type is not None}
+        unknown = list(dict.fromkeys(code for code, static_type in operands if static_type is None))
+        if len(known) > 1:
+            self.line('raise TypeError')
+        elif known:
+            expected = known.pop().__name__
+            self.line(f'if {" or ".join(f"type({code}) is not {expected}" for code in unknown)}:')
+            self.line('    raise TypeError')
+        elif len(unknown) == 2:
+            self.line(f'if type({unknown[0]}) is not type({unknown[1]}):')
+            self.line('    raise TypeError')
+        elif len(unknown) > 2:
+            self.line(f'if not ({" is ".join(f"type({code})" for code in unknown)}):')
+            self.line('    raise TypeError')
+
+    def branch(self, node: Node, scopes, tail=False):
+        # 以多一層縮排產生 if 的分支，回傳分支需要的敘述與分支的值
+        lines = self.lines
+        self.lines = []
+        self.indent += 1
+        created = len(self.created)
+        used = len(self.used)
+        try:
+            code, static_type = self.expression(node, scopes, tail)
+            if self.lines and self.indent > PYTHON_MAX_INDENT:
+                bound = set(self.created[created:])
+                free = [name for name in dict.fromkeys(self.used[used:]) if name not in bound]
+                return [], (self.hoist(self.lines, code, free), static_type)
+            return self.lines, (code, static_type)
+        finally:
+            self.lines = lines
+            self.indent -= 1
+
+    def hoist(self, lines, code, free):
+        # 把縮排太深的分支移到模組層級的函式，回傳呼叫它的程式碼；free 是分支用到、但在分支外綁定的名字，當作參數傳入
+        helper = self.new_name('_branch')
+        prefix = '    ' * self.indent
+        self.helpers.append(f'def {helper}({", ".join(free)}):')
+        self.helpers.extend('    ' + line[len(prefix):] for line in lines)
+        self.helpers.append(f'    return {code}')
+        return f'{helper}({", ".join(free)})'
 
 
 # --- Visualize AST ---
@@ -798,6 +3608,10 @@ def add_nodes_edges(graph, parent_node, level, pos, sibling_distance=10., vert_g
 
 
 def plot_tree(root):
+    # 只有需要畫出 AST 時才載入 networkx 與 matplotlib，一般執行不必付出載入成本
+    import networkx as nx
+    import matplotlib.pyplot as plt
+
     graph = nx.Graph()
     pos = {}
     pos, _ = add_nodes_edges(graph, root, 0, pos, sibling_distance=100., vert_gap=0.4, xcenter=0.5)
@@ -805,5 +3619,59 @@ def plot_tree(root):
     plt.show()
 
 
-if IS_VALID_SYNTAX and IS_DEBUG:
-    plot_tree(ast)
+if __name__ == '__main__':
+    import argparse
+
+    def non_negative(text):
+        # --inline 與 --memo-size 的值必須是非負整數
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid integer {text!r}')
+        if value < 0:
+            raise argparse.ArgumentTypeError(f'{value} is negative')
+        return value
+
+    def names(text):
+        # 以逗號分隔的函式名稱
+        return [name for name in text.split(',') if name]
+
+    arg_parser = argparse.ArgumentParser(description="Mini-LISP interpreter, runs input.txt")
+    arg_parser.add_argument("--backend", choices=BACKENDS, default=BACKEND)
+    # 預設以 run_file() 分段讀取，一律使用 ChunkScanner，不需要另外建構 ply 的 lexer；
+    # ply 改用 ply 的 lexer（使用 lextab 快取）並整個讀入 input.txt
+    arg_parser.add_argument("--lexer", choices=("scanner", "ply"), default="scanner")
+    arg_parser.add_argument("--timing", action="store_true", default=IS_TIMING,
+                            help="write a JSON report of the phase timings to stderr")
+    arg_parser.add_argument("--stream", action="store_true", default=IS_STREAMING,
+                            help="run every statement as soon as it is parsed")
+    arg_parser.add_argument("--strict", action="store_true", default=IS_STRICT,
+                            help="evaluate every operand of and/or")
+    arg_parser.add_argument("--dump-python", action="store_true",
+                            help="write the source generated by the python backend to stderr")
+    arg_parser.add_argument("--no-fold", action="store_true", help="turn constant folding off")
+    arg_parser.add_argument("--inline", type=non_negative, default=INLINE_THRESHOLD, metavar="N",
+                            help="inline functions of at most N nodes (0 turns inlining off)")
+    arg_parser.add_argument("--inline-report", action="store_true", help="write the inlined call sites to stderr")
+    arg_parser.add_argument("--no-infer", action="store_true", help="turn type inference off")
+    arg_parser.add_argument("--type-report", action="store_true",
+                            help="write the type errors found before running to stderr")
+    arg_parser.add_argument("--memo-size", type=non_negative, default=MEMO_SIZE, metavar="N",
+                            help="cache at most N call results (0 turns caching off)")
+    arg_parser.add_argument("--memoize", type=names, default=(), metavar="F,G",
+                            help="always cache these functions")
+    arg_parser.add_argument("--no-memoize", type=names, default=(), metavar="F,G",
+                            help="never cache these functions")
+    args = arg_parser.parse_args()
+    interpreter = Interpreter(debug=IS_DEBUG, timing=args.timing, scanner=args.lexer == "scanner",
+                              streaming=args.stream, backend=args.backend,
+                              dump_python=sys.stderr if args.dump_python else None,
+                              strict=args.strict, fold=not args.no_fold, inline=args.inline,
+                              inline_report=sys.stderr if args.inline_report else None,
+                              infer=not args.no_infer, type_report=sys.stderr if args.type_report else None,
+                              memo_size=args.memo_size, memoize=args.memoize, no_memoize=args.no_memoize)
+    if args.lexer == "ply":
+        with open("input.txt", "r") as f:
+            interpreter.run(f.read())
+    else:
+        interpreter.run_file("input.txt")
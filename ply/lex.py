@@ -39,6 +39,11 @@ import types
 import copy
 import os
 import inspect
+import pickle
+
+# Version of the lexer table cache format.  Caches written under a different
+# version are rebuilt.
+__tabversion__ = '2022.10.27'
 
 # This tuple contains acceptable string types
 StringTypes = (str, bytes)
@@ -146,6 +151,78 @@ class Lexer:
             c.lexmodule = object
         return c
 
+    # ------------------------------------------------------------
+    # writetab() - Write lexer information to a cache file
+    # ------------------------------------------------------------
+    def writetab(self, tabfile, signature):
+        tabre = {}
+        for statename, lre in self.lexstatere.items():
+            titem = []
+            for (pat, func), retext, renames in zip(lre, self.lexstateretext[statename], self.lexstaterenames[statename]):
+                titem.append((retext, _funcs_to_names(func, renames), renames))
+            tabre[statename] = titem
+
+        taberr = {state: (ef.__name__ if ef else None) for state, ef in self.lexstateerrorf.items()}
+        tabeof = {state: (ef.__name__ if ef else None) for state, ef in self.lexstateeoff.items()}
+
+        data = (signature, tuple(sorted(self.lextokens)), self.lexreflags, self.lexliterals,
+                self.lexstateinfo, tabre, self.lexstateignore, taberr, tabeof)
+
+        # Write to a temporary name first so that concurrent readers never see a partial cache
+        tmpname = f'{tabfile}.{os.getpid()}.tmp'
+        try:
+            with open(tmpname, 'wb') as tf:
+                pickle.dump(__tabversion__, tf, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, tf, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, tabfile)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    # ------------------------------------------------------------
+    # readtab() - Read lexer information from a cache file
+    #
+    # Returns True if the cache was written for the given signature
+    # and has been loaded, False otherwise.
+    # ------------------------------------------------------------
+    def readtab(self, tabfile, signature, fdict):
+        with open(tabfile, 'rb') as tf:
+            tabversion = pickle.load(tf)
+            if tabversion != __tabversion__:
+                return False
+            data = pickle.load(tf)
+
+        (read_signature, lextokens, reflags, literals,
+         stateinfo, tabre, stateignore, taberr, tabeof) = data
+        if read_signature != signature:
+            return False
+
+        self.lextokens      = set(lextokens)
+        self.lexreflags     = reflags
+        self.lexliterals    = literals
+        self.lextokens_all  = self.lextokens | set(self.lexliterals)
+        self.lexstateinfo   = stateinfo
+
+        self.lexstatere = {}
+        self.lexstateretext = {}
+        self.lexstaterenames = {}
+        for statename, lre in tabre.items():
+            self.lexstatere[statename] = [(re.compile(retext, reflags), _names_to_funcs(names, fdict))
+                                          for retext, names, renames in lre]
+            self.lexstateretext[statename] = [retext for retext, names, renames in lre]
+            self.lexstaterenames[statename] = [renames for retext, names, renames in lre]
+
+        self.lexstateignore = stateignore
+        self.lexstateerrorf = {state: (fdict[name] if name else None) for state, name in taberr.items()}
+        self.lexstateeoff = {state: (fdict[name] if name else None) for state, name in tabeof.items()}
+
+        self.lexre = self.lexstatere['INITIAL']
+        self.lexretext = self.lexstateretext['INITIAL']
+        self.lexignore = self.lexstateignore.get('INITIAL', '')
+        self.lexerrorf = self.lexstateerrorf.get('INITIAL', None)
+        self.lexeoff = self.lexstateeoff.get('INITIAL', None)
+        return True
+
     # ------------------------------------------------------------
     # input() - Push a new string into the lexer
     # ------------------------------------------------------------
@@ -340,6 +417,36 @@ def get_caller_module_dict(levels):
     f = sys._getframe(levels)
     return { **f.f_globals, **f.f_locals }
 
+# -----------------------------------------------------------------------------
+# _funcs_to_names()
+#
+# Given a list of regular expression functions, this converts it to a list
+# suitable for output to a table cache
+# -----------------------------------------------------------------------------
+def _funcs_to_names(funclist, namelist):
+    result = []
+    for f, name in zip(funclist, namelist):
+        if f and f[0]:
+            result.append((name, f[1]))
+        else:
+            result.append(f)
+    return result
+
+# -----------------------------------------------------------------------------
+# _names_to_funcs()
+#
+# Given a list of regular expression function names, this converts it back to
+# functions.
+# -----------------------------------------------------------------------------
+def _names_to_funcs(namelist, fdict):
+    result = []
+    for n in namelist:
+        if n and n[0]:
+            result.append((fdict[n[0]], n[1]))
+        else:
+            result.append(n)
+    return result
+
 # -----------------------------------------------------------------------------
 # _form_master_re()
 #
@@ -434,6 +541,17 @@ class LexerReflect(object):
         self.validate_rules()
         return self.error
 
+    # Compute a signature over the lexer specification
+    def signature(self):
+        parts = [repr(self.tokens), repr(self.literals), repr(sorted(self.stateinfo.items())), str(self.reflags)]
+        for state in sorted(self.stateinfo):
+            parts.extend(f'{fname}={_get_regex(f)}' for fname, f in self.funcsym[state])
+            parts.extend(f'{name}={r}' for name, r in self.strsym[state])
+        parts.append(repr(sorted(self.ignore.items())))
+        parts.append(repr(sorted((state, f.__name__) for state, f in self.errorf.items())))
+        parts.append(repr(sorted((state, f.__name__) for state, f in self.eoff.items())))
+        return '\n'.join(parts)
+
     # Get the tokens map
     def get_tokens(self):
         tokens = self.ldict.get('tokens', None)
@@ -715,7 +833,7 @@ class LexerReflect(object):
 # Build all of the regular expression rules from definitions in the supplied module
 # -----------------------------------------------------------------------------
 def lex(*, module=None, object=None, debug=False, 
-        reflags=int(re.VERBOSE), debuglog=None, errorlog=None):
+        reflags=int(re.VERBOSE), debuglog=None, errorlog=None, lextab=None):
 
     global lexer
 
@@ -748,6 +866,19 @@ def lex(*, module=None, object=None, debug=False,
     # Collect parser information from the dictionary
     linfo = LexerReflect(ldict, log=errorlog, reflags=reflags)
     linfo.get_all()
+
+    # If a table cache was requested, try to load the validated specification
+    # from it.  A missing, stale or corrupt cache falls through to a full build.
+    if lextab and not debug and not linfo.error:
+        try:
+            if lexobj.readtab(lextab, linfo.signature(), ldict):
+                token = lexobj.token
+                input = lexobj.input
+                lexer = lexobj
+                return lexobj
+        except Exception:
+            lexobj = Lexer()
+
     if linfo.validate_all():
         raise SyntaxError("Can't build lexer")
 
@@ -845,6 +976,12 @@ def lex(*, module=None, object=None, debug=False,
             if s not in linfo.ignore:
                 linfo.ignore[s] = linfo.ignore.get('INITIAL', '')
 
+    if lextab:
+        try:
+            lexobj.writetab(lextab, linfo.signature())
+        except IOError as e:
+            errorlog.warning(f"Couldn't write lexer table cache {lextab!r}. {e}")
+
     # Create global versions of the token() and input() functions
     token = lexobj.token
     input = lexobj.input
@@ -64,7 +64,9 @@
 import re
 import types
 import sys
+import os
 import inspect
+import pickle
 
 #-----------------------------------------------------------------------------
 #                     === User configurable parameters ===
@@ -79,6 +81,9 @@ debug_file  = 'parser.out'     # Default name of the debugging file
 error_count = 3                # Number of symbols that must be shifted to leave recovery mode
 resultlimit = 40               # Size limit of results when running in debug mode.
 
+__tabversion__ = '2022.10.27'  # Version of the table cache format.  Caches written
+                               # under a different version are rebuilt.
+
 MAXINT = sys.maxsize
 
 # This object is a stand-in for a logging object created by the
@@ -682,6 +687,34 @@ class Production(object):
         if self.func:
             self.callable = pdict[self.func]
 
+# -----------------------------------------------------------------------------
+# class MiniProduction
+#
+# A stripped down version of Production that is restored from a table cache.
+# It only holds the information needed by the LR parsing engine.
+# -----------------------------------------------------------------------------
+
+class MiniProduction(object):
+    def __init__(self, str, name, len, func, file, line):
+        self.name     = name
+        self.len      = len
+        self.func     = func
+        self.callable = None
+        self.file     = file
+        self.line     = line
+        self.str      = str
+
+    def __str__(self):
+        return self.str
+
+    def __repr__(self):
+        return 'MiniProduction(%s)' % self.str
+
+    # Bind the production function name to a callable
+    def bind(self, pdict):
+        if self.func:
+            self.callable = pdict[self.func]
+
 # -----------------------------------------------------------------------------
 # class LRItem
 #
@@ -1301,6 +1334,42 @@ class LALRError(YaccError):
     pass
 
 
+# -----------------------------------------------------------------------------
+#                           == CachedLRTable ==
+#
+# This class holds finished LR tables restored from a cache file written by
+# LRTable.write_cache().  Loading a cache skips all of the table construction
+# performed by LRTable.
+# -----------------------------------------------------------------------------
+
+class CachedLRTable:
+    def __init__(self):
+        self.lr_action      = None
+        self.lr_goto        = None
+        self.lr_productions = None
+
+    # Read the tables from filename and return the grammar signature stored
+    # with them.  Raises VersionError if the cache format is out of date.
+    def read_cache(self, filename):
+        with open(filename, 'rb') as in_f:
+            tabversion = pickle.load(in_f)
+            if tabversion != __tabversion__:
+                raise VersionError('yacc table cache version is out of date')
+            signature, action, goto, productions = pickle.load(in_f)
+
+        self.lr_action = action
+        self.lr_goto = goto
+        self.lr_productions = [MiniProduction(*p) for p in productions]
+        return signature
+
+    # Bind all production function names to callable objects in pdict
+    def bind_callables(self, pdict):
+        for p in self.lr_productions:
+            p.bind(pdict)
+
+class VersionError(YaccError):
+    pass
+
 # -----------------------------------------------------------------------------
 #                             == LRTable ==
 #
@@ -1345,6 +1414,23 @@ class LRTable:
         for p in self.lr_productions:
             p.bind(pdict)
 
+    # Write the action, goto and production tables to filename so that a later
+    # call to yacc() can load them with CachedLRTable.  The file is written to
+    # a temporary name first so that concurrent readers never see a partial cache.
+    def write_cache(self, filename, signature):
+        productions = [(p.str, p.name, p.len, p.func, os.path.basename(p.file), p.line)
+                       for p in self.lr_productions]
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(tmpname, 'wb') as out_f:
+                pickle.dump(__tabversion__, out_f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((signature, self.lr_action, self.lr_goto, productions),
+                            out_f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
     # Compute the LR(0) closure operation on I, where I is a set of LR(0) items.
 
     def lr0_closure(self, I):
@@ -2270,7 +2356,7 @@ class ParserReflect(object):
 
 def yacc(*, debug=yaccdebug, module=None, start=None,
          check_recursion=True, optimize=False, debugfile=debug_file,
-         debuglog=None, errorlog=None):
+         debuglog=None, errorlog=None, tabfile=None):
 
     # Reference to the parsing method of the last built parser
     global parse
@@ -2303,6 +2389,22 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
     if pinfo.error:
         raise YaccError('Unable to build parser')
 
+    # If a table cache was requested, try to load finished tables from it.  The
+    # cache is only used when it was written for exactly this grammar; anything
+    # else (missing, stale, corrupt) falls through to a full rebuild below.
+    signature = pinfo.signature()
+    if tabfile and not debug:
+        try:
+            lr = CachedLRTable()
+            read_signature = lr.read_cache(tabfile)
+            if read_signature == signature:
+                lr.bind_callables(pinfo.pdict)
+                parser = LRParser(lr, pinfo.error_func)
+                parse = parser.parse
+                return parser
+        except Exception:
+            pass
+
     if debuglog is None:
         if debug:
             try:
@@ -2474,6 +2576,12 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
                 errorlog.warning('Rule (%s) is never reduced', rejected)
                 warned_never.append(rejected)
 
+    if tabfile:
+        try:
+            lr.write_cache(tabfile, signature)
+        except IOError as e:
+            errorlog.warning("Couldn't write table cache %r. %s" % (tabfile, e))
+
     # Build the parser
     lr.bind_callables(pinfo.pdict)
     parser = LRParser(lr, pinfo.error_func)
@@ -1,7 +1,395 @@
 import os
+import subprocess
+import sys
 
 # Available only IS_DEBUG is False
 
+
+def check_startup_imports():
+    # 一般模式不應載入畫 AST 用的 networkx 與 matplotlib
+    result = subprocess.run([sys.executable, "-X", "importtime", "main.py"], capture_output=True, text=True)
+    imported = [name for name in ("networkx", "matplotlib") if name in result.stderr]
+    if imported:
+        sys.exit("Startup regression: main.py imported " + ", ".join(imported) + " on the normal path")
+
+
+def token_stream(lexer, source):
+    lexer.input(source)
+    return [(tok.type, repr(tok.value), tok.lineno, tok.lexpos) for tok in lexer]
+
+
+def check_scanner_conformance():
+    # 手寫的 Scanner 必須產生與 ply lexer 完全相同的 token 串流
+    import main
+    from ply.lex import lex
+
+    ply_lexer = lex(module=main)
+    scanner = main.Scanner()
+    for directory in ("test_data", "hidden_data"):
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), "r") as f:
+                source = f.read()
+            if token_stream(ply_lexer, source) != token_stream(scanner, source):
+                sys.exit("Scanner conformance: token stream differs from ply on " + os.path.join(directory, file))
+
+
+def check_chunk_boundaries(sizes=range(1, 12)):
+    # ChunkScanner 以很小的區塊讀取時，token 跨越區塊邊界也要與一次掃描整個原始碼的 Scanner 相同
+    import io
+    import main
+
+    scanner = main.Scanner()
+    for directory in ("test_data", "hidden_data"):
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), "r") as f:
+                source = f.read()
+            expected = token_stream(scanner, source)
+            for size in sizes:
+                chunks = main.ChunkScanner(io.StringIO(source), size)
+                tokens = [(tok.type, repr(tok.value), tok.lineno, tok.lexpos) for tok in iter(chunks.token, None)]
+                if tokens != expected:
+                    sys.exit("Chunk boundaries: ChunkScanner(%d) differs from Scanner on %s"
+                             % (size, os.path.join(directory, file)))
+
+
+def check_token_buffer():
+    # TokenBuffer 重播的 token 與 Scanner 相同；同一個 TokenBuffer 分析兩次，都與直接分析原始碼的 AST 相同
+    import main
+
+    interpreter = main.Interpreter(out=open(os.devnull, "w"))
+    scanner = main.Scanner()
+
+    def parsed(source):
+        try:
+            return repr(interpreter.parse(source))
+        except main.MiniLispSyntaxError as e:
+            return str(e)
+
+    for directory in ("test_data", "hidden_data"):
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), "r") as f:
+                source = f.read()
+            buffer = interpreter.tokenize(source)
+            scanner.input(source)
+            expected = [(tok.type, tok.value, tok.lexpos) for tok in scanner]
+            replayed = [(tok.type, tok.value, start) for tok, start in zip(buffer, buffer.starts)]
+            if len(buffer) != len(expected) or replayed != expected:
+                sys.exit("Token buffer: replayed tokens differ from Scanner on " + os.path.join(directory, file))
+            ast = parsed(source)
+            if parsed(buffer) != ast or parsed(buffer) != ast:
+                sys.exit("Token buffer: parsing the buffer differs from parsing the source on "
+                         + os.path.join(directory, file))
+
+
+def check_parser_table_cache():
+    # 損毀、格式過時或文法不符的 parsetab 快取要重建，不能讓 yacc() 失敗或載入錯誤的表
+    import pickle
+    import tempfile
+    import main
+    from ply import yacc
+
+    with tempfile.TemporaryDirectory() as directory:
+        reference = os.path.join(directory, "reference.pickle")
+        yacc.yacc(module=main, tabfile=reference)
+        signature = yacc.CachedLRTable().read_cache(reference)
+        with open(reference, "rb") as f:
+            truncated = f.read()[:100]
+        tabfile = os.path.join(directory, "parsetab.pickle")
+        caches = {
+            "corrupt": b"not a pickle",
+            "truncated": truncated,
+            "old format": pickle.dumps("1970.01.01") + pickle.dumps(None),
+            "other grammar": pickle.dumps(yacc.__tabversion__) + pickle.dumps(("other", {}, {}, [])),
+        }
+        for name, content in caches.items():
+            with open(tabfile, "wb") as f:
+                f.write(content)
+            try:
+                parser = yacc.yacc(module=main, tabfile=tabfile)
+                ast = parser.parse("(print-num (+ 1 2))", lexer=main.Scanner())
+                rebuilt = ast.children[0].type == "PRINT_NUM" and yacc.CachedLRTable().read_cache(tabfile) == signature
+            except Exception:
+                rebuilt = False
+            if not rebuilt:
+                sys.exit("Parser table cache: a %s parsetab was not rebuilt" % name)
+
+
+def check_lexer_table_cache():
+    # 損毀、格式過時或規則不符的 lextab 快取要重建，重建後的 lexer 與 Scanner 產生相同的 token
+    import pickle
+    import tempfile
+    import main
+    from ply import lex
+
+    def cached_data(path):
+        with open(path, "rb") as f:
+            pickle.load(f)
+            return pickle.load(f)
+
+    source = "(define f (fun (x) (+ x 1)))\n(print-num (f 2))\n"
+    with tempfile.TemporaryDirectory() as directory:
+        reference = os.path.join(directory, "reference.pickle")
+        lex.lex(module=main, lextab=reference)
+        data = cached_data(reference)
+        with open(reference, "rb") as f:
+            truncated = f.read()[:100]
+        tabfile = os.path.join(directory, "lextab.pickle")
+        caches = {
+            "corrupt": b"not a pickle",
+            "truncated": truncated,
+            "old format": pickle.dumps("1970.01.01") + pickle.dumps(None),
+            "other rules": pickle.dumps(lex.__tabversion__) + pickle.dumps(("other",) + data[1:]),
+        }
+        for name, content in caches.items():
+            with open(tabfile, "wb") as f:
+                f.write(content)
+            try:
+                lexer = lex.lex(module=main, lextab=tabfile)
+                rebuilt = (token_stream(lexer, source) == token_stream(main.Scanner(), source)
+                           and cached_data(tabfile)[0] == data[0])
+            except Exception:
+                rebuilt = False
+            if not rebuilt:
+                sys.exit("Lexer table cache: a %s lextab was not rebuilt" % name)
+
+
+def backend_result(backend, source, **options):
+    import io
+    import main
+
+    out = io.StringIO()
+    try:
+        main.Interpreter(out=out, backend=backend, **options).run(source)
+    except Exception as e:
+        # 尚未支援的語法（例如 b4 的高階函式）會讓直譯器當掉，當掉的方式也要一致
+        return out.getvalue(), type(e).__name__
+    return out.getvalue(), None
+
+
+def check_backend_conformance():
+    # 每個執行後端都必須和 tree（travel_ast）產生相同的輸出；對照組不展開函式也不推導型別，
+    # 同時檢查 inline_functions() 與 infer_types()
+    import main
+
+    cases = []
+    for directory in ("test_data", "hidden_data"):
+        for file in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file), "r") as f:
+                cases.append((os.path.join(directory, file), f.read()))
+    # 引數的型別錯誤要先於未定義的函式
+    cases.append(("undefined function", "(print-num (nope (+ 1 #t)))\n"))
+    for name, source in cases:
+        expected = backend_result("tree", source, inline=0, infer=False)
+        for backend in main.BACKENDS:
+            if backend_result(backend, source) != expected:
+                sys.exit(f"Backend conformance: {backend} differs from tree on " + name)
+
+
+def check_arity_errors():
+    # 引數比參數少時，每個後端都拋出 MiniLispArityError（具名、匿名、函式內的函式與尾端呼叫）
+    import main
+
+    sources = [
+        "(define f (fun (x y) (+ x y)))\n(print-num (f 1))\n",
+        "(print-num ((fun (x y) (+ x y)) 1))\n",
+        "(define f (fun (x) (define g (fun (a b) a)) (+ 1 (g x))))\n(print-num (f 1))\n",
+        "(define g (fun (a b) a))\n(define f (fun (x) (g x)))\n(print-num (f 1))\n",
+        "(define f (fun (x) (define g (fun (a b) a)) (g x)))\n(print-num (f 1))\n",
+    ]
+    for source in sources:
+        for backend in main.BACKENDS:
+            for options in ({}, {"inline": 0, "infer": False}):
+                result = backend_result(backend, source, **options)
+                if result != ("", "MiniLispArityError"):
+                    sys.exit(f"Arity errors: {backend} returned {result} for {source!r} with {options}")
+
+
+def check_constant_folding():
+    # 常數摺疊不移動錯誤：會拋出例外的運算保持原樣，執行到的時候才出錯，沒有執行到的分支與函式不會出錯
+    import main
+
+    cases = [
+        ("(print-num 1)\n(print-num (+ 1 #t))\n(print-num 2)\n", ("1\nType error!\n", None)),
+        ("(print-num 1)\n(print-num (/ 1 0))\n", ("1\n", "ZeroDivisionError")),
+        ("(define f (fun () (+ 1 #t)))\n(print-num 3)\n", ("3\n", None)),
+        ("(print-num (if #t 1 (+ 1 #t)))\n", ("1\n", None)),
+        ("(print-num (* 2 (- 5 (not 1))))\n", ("Type error!\n", None)),
+    ]
+    for source, expected in cases:
+        for backend in main.BACKENDS:
+            for options in ({}, {"fold": False}):
+                result = backend_result(backend, source, **options)
+                if result != expected:
+                    sys.exit(f"Constant folding: {backend} returned {result} for {source!r} with {options}")
+    interpreter = main.Interpreter(out=open(os.devnull, "w"))
+    folded = interpreter.parse("(print-num (+ 1 (* 2 3)))\n(print-num (+ 1 #t))\n")
+    if [stmt.children[0].type for stmt in folded.children] != ["NUMBER", "PLUS"]:
+        sys.exit("Constant folding: expected (+ 1 (* 2 3)) folded and (+ 1 #t) kept, got " + repr(folded))
+
+
+def check_short_circuit():
+    # and/or 預設在結果確定之後不再計算其餘的運算元；strict 模式計算所有運算元，型別錯誤照常發生
+    import main
+
+    cases = [
+        ("(print-bool (and #f (+ 1 #t)))\n", "#f\n"),
+        ("(print-bool (or #t (+ 1 #t)))\n", "#t\n"),
+        ("(define f (fun (x) (and (> x 0) (= (+ x #t) 1))))\n(print-bool (f 0))\n", "#f\n"),
+    ]
+    for source, expected in cases:
+        for backend in main.BACKENDS:
+            for options in ({}, {"fold": False, "inline": 0, "infer": False}):
+                for strict, output in ((False, expected), (True, "Type error!\n")):
+                    result = backend_result(backend, source, strict=strict, **options)
+                    if result != (output, None):
+                        sys.exit(f"Short circuit: {backend} returned {result} for {source!r} "
+                                 f"with strict={strict} {options}")
+
+
+def check_memo_invalidation():
+    # 重新定義全域函式或變數之後，memo 不能回傳用舊定義算出的結果
+    import io
+    import main
+
+    sessions = [
+        (["(define g (fun () 0)) (define f (fun (n) (+ n (g))))", "(print-num (f 1))",
+          "(define g (fun () 50))", "(print-num (f 1))"], "1\n51\n"),
+        (["(define y 7) (define h (fun (n) (+ n y)))", "(print-num (h 1))",
+          "(define y 1000)", "(print-num (h 1))"], "8\n1001\n"),
+    ]
+    for backend in main.BACKENDS:
+        for statements, expected in sessions:
+            out = io.StringIO()
+            interpreter = main.Interpreter(out=out, backend=backend, inline=0, memoize=("f", "h"))
+            for statement in statements:
+                interpreter.eval(statement)
+            if out.getvalue() != expected:
+                sys.exit(f"Memo invalidation: {backend} printed {out.getvalue()!r} instead of {expected!r}")
+
+
+def check_inline_report():
+    # inline_report 依序列出每個展開的呼叫處；遞迴函式不展開，inline=0 時不展開任何函式
+    import io
+    import main
+
+    program = ("(define sq (fun (x) (* x x)))\n(define f (fun (y) (+ (sq y) 1)))\n(print-num (f 3))\n"
+               "(define loop (fun (n) (if (= n 0) 0 (loop (- n 1)))))\n(print-num (loop 3))\n")
+    expected = "inline sq into f at statement 2\ninline f at statement 3\n"
+    for backend in main.BACKENDS:
+        for threshold, report in ((main.INLINE_THRESHOLD, expected), (0, "")):
+            out = io.StringIO()
+            inline_report = io.StringIO()
+            main.Interpreter(out=out, backend=backend, inline=threshold, inline_report=inline_report).run(program)
+            if (out.getvalue(), inline_report.getvalue()) != ("10\n0\n", report):
+                sys.exit(f"Inline report: {backend} with inline={threshold} printed {out.getvalue()!r} "
+                         f"and reported {inline_report.getvalue()!r}")
+
+
+def check_run_then_eval(**options):
+    # run() 之後 eval() 仍然看得到 run() 定義的函式；重新定義被展開過的函式之後，展開了它的函式（包含間接展開的）也要改變
+    import main
+
+    program = ("(define g (fun (x) (* x 10))) (define c (fun (x) (+ (g x) 1))) (define d (fun (x) (c x)))\n"
+               "(print-num (d 1))\n")
+    for backend in main.BACKENDS:
+        interpreter = main.Interpreter(out=open(os.devnull, "w"), backend=backend, **options)
+        interpreter.run(program)
+        results = [interpreter.eval("(d 2)")]
+        interpreter.eval("(define g (fun (x) (* x 100)))")
+        results.append(interpreter.eval("(d 2)"))
+        if results != [21, 201]:
+            sys.exit(f"Run then eval: {backend} returned {results} instead of [21, 201] with {options}")
+
+
+def check_type_inference():
+    # 數值程式的型別檢查全部被 infer_types() 證明，tree 與 stackless 執行時不再檢查；
+    # type_report 在執行前列出一定會發生的型別錯誤
+    import io
+    import main
+
+    source = "(define fact (fun (n) (if (= n 0) 1 (* n (fact (- n 1))))))\n(print-num (fact 10))\n"
+    for backend in ("tree", "stackless"):
+        counts = []
+        for infer in (True, False):
+            interpreter = main.Interpreter(out=io.StringIO(), backend=backend, infer=infer)
+            interpreter.run(source)
+            counts.append(interpreter.type_checks)
+        if counts[0] != 0 or counts[1] == 0:
+            sys.exit(f"Type inference: {backend} ran {counts[0]} type checks with inference, {counts[1]} without")
+    source = "(print-num 1)\n(print-num (+ 1 #t))\n(define f (fun (x) (not x)))\n(print-num (f 1))\n"
+    expected = ("type error at statement 2: PLUS operands are int and bool\n"
+                "type error at statement 4: PRINT_NUM expects int, got bool\n"
+                "type error at statement 4: NOT expects bool, got int\n")
+    out = io.StringIO()
+    type_report = io.StringIO()
+    main.Interpreter(out=out, type_report=type_report).run(source)
+    if (out.getvalue(), type_report.getvalue()) != ("1\nType error!\n", expected):
+        sys.exit(f"Type inference: printed {out.getvalue()!r} and reported {type_report.getvalue()!r}")
+
+
+def check_stale_proofs():
+    # run() 推導的型別在 eval() 之後作廢：以其他型別呼叫函式或重新定義變數時仍然要做型別檢查
+    import main
+
+    program = "(define a 1)\n(define f (fun (x) (+ x a)))\n(print-num (f 1))\n"
+    for backend in main.BACKENDS:
+        for source in ("(f #t)", "(define a #t) (f 1)"):
+            interpreter = main.Interpreter(out=open(os.devnull, "w"), backend=backend)
+            interpreter.run(program)
+            try:
+                result = interpreter.eval(source)
+            except TypeError:
+                continue
+            sys.exit(f"Stale proofs: {backend} returned {result!r} for {source}")
+
+
+def check_deep_recursion(depth=100000):
+    # stackless 後端的遞迴深度不受 Python 的遞迴限制
+    source = "(define sum-to (fun (n) (if (= n 0) 0 (+ n (sum-to (- n 1))))))\n(print-num (sum-to %d))\n" % depth
+    result = backend_result("stackless", source)
+    if result != ("%d\n" % (depth * (depth + 1) // 2), None):
+        sys.exit("Deep recursion: stackless backend returned %r for sum-to %d" % (result, depth))
+
+
+def check_tail_calls(depth=100000):
+    # 尾端呼叫不增加 Python 的遞迴深度：尾遞迴與互相尾遞迴都能執行 depth 次
+    import main
+
+    sources = [
+        ("(define count-down (fun (n) (if (= n 0) 0 (count-down (- n 1)))))\n(print-num (count-down %d))\n" % depth,
+         "0\n"),
+        ("(define even (fun (n) (if (= n 0) #t (odd (- n 1)))))\n"
+         "(define odd (fun (n) (if (= n 0) #f (even (- n 1)))))\n"
+         "(print-bool (even %d))\n(print-bool (odd %d))\n" % (depth, depth), "#t\n#f\n"),
+    ]
+    for source, expected in sources:
+        for backend in main.BACKENDS:
+            result = backend_result(backend, source)
+            if result != (expected, None):
+                sys.exit("Tail calls: %s backend returned %r for %d calls" % (backend, result, depth))
+
+
+def check_deep_nesting(depth=900, python_depth=450):
+    # 巢狀的運算式在預設的遞迴上限下至少要能有 depth 層；python 後端翻譯每層占兩個堆疊，只要求 python_depth 層，
+    # 產生的原始碼不能超過 CPython 的括號與縮排限制
+    import main
+
+    for backend in main.BACKENDS:
+        levels = python_depth if backend == "python" else depth
+        sources = [
+            ("(define x 1)\n(print-num " + "(+ x " * levels + "1" + ")" * levels + ")\n", "%d\n" % (levels + 1)),
+            ("(define b #t)\n(print-num " + "(if b " * levels + "1" + " 2)" * levels + ")\n", "1\n"),
+            ("(define b #t)\n(print-bool " + "(and b " * levels + "b" + ")" * levels + ")\n", "#t\n"),
+            # 移到模組層級的分支用到參數與函式內的函式
+            ("(define f (fun (x y) (define k (fun (z) (+ z y))) " + "(if (> x 0) (k " * 100 + "x" + ") 0)" * 100
+             + "))\n(print-num (f 1 2))\n", "201\n"),
+        ]
+        for source, expected in sources:
+            result = backend_result(backend, source)
+            if result != (expected, None):
+                sys.exit("Deep nesting: %s backend returned %r for %d levels" % (backend, result, levels))
+
+
 for root, dirs, files in os.walk("test_data"):
     for file in files:
         # skip the bonus test cases
@@ -14,3 +402,23 @@ for root, dirs, files in os.walk("test_data"):
         # run main.py
         print("Running main.py with input file: " + file)
         os.system("python main.py")
+
+check_startup_imports()
+check_scanner_conformance()
+check_chunk_boundaries()
+check_token_buffer()
+check_parser_table_cache()
+check_lexer_table_cache()
+check_backend_conformance()
+check_arity_errors()
+check_constant_folding()
+check_short_circuit()
+check_memo_invalidation()
+check_inline_report()
+check_run_then_eval()
+check_run_then_eval(infer=False)
+check_type_inference()
+check_stale_proofs()
+check_deep_recursion()
+check_tail_calls()
+check_deep_nesting()